@@ -0,0 +1,234 @@
+import os
+import time
+import base64
+import hashlib
+import logging
+import threading
+import urllib3
+import requests
+
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+TARGET_CHUNK_SECONDS = 0.25  # aim for chunks that take about this long, so slow links still make progress
+HASH_READ_SIZE = 1024 * 1024
+
+
+class QuickXorHash:
+    """
+    OneDrive's quickXorHash: bytes are XORed into a 160 bit circular register, each
+    byte shifted 11 bits further than the previous one, then the length is XORed into
+    the last 8 bytes. Returned base64 encoded, the same as file.hashes.quickXorHash.
+
+    Byte i lands at bit (i * 11) % 160, which repeats every 160 bytes, so the data is
+    first XOR-folded into one 160 byte block (with big ints, in C) and only those
+    160 bytes are shifted into place one by one.
+    """
+    WIDTH_IN_BITS = 160
+    SHIFT = 11
+    BLOCK = 160  # bytes per period of the shift pattern
+
+    def __init__(self):
+        self._folded = 0      # XOR of all complete, aligned 160 byte blocks so far
+        self._pending = b""   # bytes not yet making up a full block
+        self._length = 0
+
+    def update(self, data: bytes) -> None:
+        self._length += len(data)
+        data = self._pending + data
+        usable = len(data) - len(data) % self.BLOCK
+        self._pending = data[usable:]
+        if usable:
+            self._folded ^= self._fold(int.from_bytes(data[:usable], "little"), usable)
+
+    def digest(self) -> bytes:
+        folded = self._folded ^ int.from_bytes(self._pending, "little")
+        block = folded.to_bytes(self.BLOCK, "little")
+
+        mask = (1 << self.WIDTH_IN_BITS) - 1
+        register = 0
+        for i, byte in enumerate(block):
+            if byte:
+                shift = (i * self.SHIFT) % self.WIDTH_IN_BITS
+                register ^= ((byte << shift) | (byte >> (self.WIDTH_IN_BITS - shift))) & mask
+
+        result = bytearray(register.to_bytes(self.WIDTH_IN_BITS // 8, "little"))
+        for i, length_byte in enumerate(self._length.to_bytes(8, "little")):
+            result[self.WIDTH_IN_BITS // 8 - 8 + i] ^= length_byte
+        return bytes(result)
+
+    def b64digest(self) -> str:
+        return base64.b64encode(self.digest()).decode("ascii")
+
+    def _fold(self, value: int, size: int) -> int:
+        # Halve the number of blocks each round: XOR the top half onto the bottom half.
+        blocks = size // self.BLOCK
+        while blocks > 1:
+            half = blocks // 2
+            bits = (blocks - half) * self.BLOCK * 8
+            value = (value & ((1 << bits) - 1)) ^ (value >> bits)
+            blocks -= half
+        return value
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all downloads, so parallel downloads together stay under max_bytes_per_sec.
+    max_bytes_per_sec of 0 or None means unlimited.
+    """
+
+    def __init__(self, max_bytes_per_sec: int = None):
+        self.max_bytes_per_sec = max_bytes_per_sec or 0
+        self._lock = threading.Lock()
+        self._allowance = float(self.max_bytes_per_sec)
+        self._last = time.monotonic()
+
+    def consume(self, num_bytes: int) -> None:
+        if not self.max_bytes_per_sec:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.max_bytes_per_sec, self._allowance + (now - self._last) * self.max_bytes_per_sec)
+            self._last = now
+            self._allowance -= num_bytes
+            wait = -self._allowance / self.max_bytes_per_sec if self._allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Downloader:
+    """
+    Resumable, verified downloads of OneDrive files.
+    - Writes to <file>.part and resumes it with an HTTP Range request after a failure
+    - Reads in adaptive chunks (64 KB - 4 MB) sized to the link speed
+    - Verifies the result against sha1Hash / quickXorHash from the Graph listing
+    - Asks refresh_url(file_id) for a new @microsoft.graph.downloadUrl when the old one expired
+    - Shares one BandwidthLimiter between all downloads, so it is safe to run several in parallel;
+      shared_limiter also caps them together with other Downloaders, max_bytes_per_sec only this one
+    - Sends its requests through `session`, e.g. the account's rate limited GraphSession
+    """
+
+    def __init__(self, refresh_url=None, max_bytes_per_sec: int = None, max_attempts: int = 5, timeout: tuple = (10, 60), session=None, shared_limiter: BandwidthLimiter = None):
+        self.refresh_url = refresh_url
+        self.shared_limiter = shared_limiter
+        self.session = session or requests.Session()
+        self.limiter = BandwidthLimiter(max_bytes_per_sec)
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+    def download(self, download_url: str, dest_path: str, file_id: str = None, hashes: dict = None, size: int = None) -> str:
+        """
+        Download to dest_path and return it. Raises if the file can't be fetched or fails verification.
+        """
+        part_path = f"{dest_path}.part"
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        if not download_url:
+            # The listing doesn't always carry @microsoft.graph.downloadUrl; get one instead of retrying "".
+            if not (self.refresh_url and file_id):
+                raise Exception(f"Failed to download {dest_path}: no download URL, and no way to get one")
+            download_url = self.refresh_url(file_id)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                status = self._fetch(download_url, part_path, size)
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as ex:
+                # Keep the .part file, the next attempt resumes from it.
+                logging.warning(f"Download of {dest_path} interrupted (attempt {attempt}): {ex}")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            if status in (401, 403, 404, 410):
+                # Pre-authenticated download URLs expire after about an hour.
+                if not (self.refresh_url and file_id):
+                    raise Exception(f"Failed to download {dest_path}: {status}, and no way to refresh the download URL")
+                logging.info(f"Download URL for {dest_path} expired ({status}), refreshing it")
+                download_url = self.refresh_url(file_id)
+                continue
+            if status == 429 or status >= 500:
+                logging.warning(f"Download of {dest_path} got {status} (attempt {attempt}), retrying")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            if status not in (200, 206):
+                raise Exception(f"Failed to download {dest_path}: {status}")
+
+            if size is not None and os.path.getsize(part_path) < size:
+                logging.warning(f"Download of {dest_path} ended early (attempt {attempt}), resuming")
+                continue
+            if not self._verify(part_path, hashes, size):
+                # A corrupt .part can't be resumed, start over.
+                os.remove(part_path)
+                logging.warning(f"Download of {dest_path} failed verification (attempt {attempt}), restarting")
+                continue
+
+            os.replace(part_path, dest_path)
+            return dest_path
+
+        raise Exception(f"Failed to download {dest_path} after {self.max_attempts} attempts")
+
+    def _fetch(self, download_url: str, part_path: str, size: int = None) -> int:
+        """
+        Fetch (the rest of) the file into part_path. Returns the HTTP status code.
+        A 200/206 return means the body was read to the end.
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size is not None and offset == size:
+            return 200
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(download_url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416 and offset:
+                # Nothing left to fetch; let verification decide whether the .part is good.
+                return 200
+            if response.status_code not in (200, 206):
+                logging.error(f"Download error: {response.status_code}, {response.text[:300]}")
+                return response.status_code
+
+            # 200 means the server ignored the Range header and is sending the whole file.
+            mode = "ab" if response.status_code == 206 else "wb"
+            chunk_size = MIN_CHUNK_SIZE
+            with open(part_path, mode) as f:
+                while True:
+                    started = time.monotonic()
+                    chunk = response.raw.read(chunk_size, decode_content=True)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    self.limiter.consume(len(chunk))
+                    if self.shared_limiter is not None:
+                        self.shared_limiter.consume(len(chunk))
+
+                    elapsed = time.monotonic() - started
+                    if elapsed < TARGET_CHUNK_SECONDS / 2:
+                        chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+                    elif elapsed > TARGET_CHUNK_SECONDS * 2:
+                        chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+            return response.status_code
+
+    @staticmethod
+    def _verify(path: str, hashes: dict = None, size: int = None) -> bool:
+        if size is not None and os.path.getsize(path) != size:
+            logging.warning(f"Size mismatch for {path}: expected {size}, got {os.path.getsize(path)}")
+            return False
+        hashes = hashes or {}
+
+        # Prefer sha1 (hashlib is C), fall back to quickXorHash, which OneDrive always provides.
+        if hashes.get("sha1Hash"):
+            expected = hashes["sha1Hash"].lower()
+            actual = Downloader._hash_file(path, hashlib.sha1()).hexdigest()
+        elif hashes.get("quickXorHash"):
+            expected = hashes["quickXorHash"]
+            actual = Downloader._hash_file(path, QuickXorHash()).b64digest()
+        else:
+            return True
+
+        if actual != expected:
+            logging.warning(f"Hash mismatch for {path}: expected {expected}, got {actual}")
+            return False
+        return True
+
+    @staticmethod
+    def _hash_file(path: str, hasher):
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+                hasher.update(block)
+        return hasher
@@ -4,9 +4,14 @@ import time
 import html
 import logging
 import calendar
+import threading
 import requests
 
 
+JWT_LIFETIME_SECONDS = 5 * 60
+JWT_RENEW_MARGIN_SECONDS = 60  # mint a new token this long before the current one expires
+
+
 class Ghost:
     """
     Class to handle Ghhost API operations
@@ -17,16 +22,27 @@ class Ghost:
         self.admin_api_url = admin_api_url.rstrip("/")
         self.admin_api_key = admin_api_key
 
+        self._auth_header = None
+        self._auth_renew_at = 0
+        # slug -> {"id", "slug", "updated_at"}, filled once by load_post_index() and kept current by upserts.
+        self._post_index = None
+        self._lock = threading.Lock()
+
 
     def _get_ghost_api_auth_header(self, admin_api_key: str) -> dict:
         """
-        Authenticate to Ghost Admin API using JWT signed with Admin key secret
+        Authenticate to Ghost Admin API using JWT signed with Admin key secret.
+        The token is reused until shortly before it expires.
         """
+        with self._lock:
+            if self._auth_header and time.time() < self._auth_renew_at:
+                return self._auth_header
+
         key_id, secret = admin_api_key.split(":")
         iat = int(time.time())
         payload = {
             "iat": iat,
-            "exp": iat + 5 * 60,       # 5 minutes
+            "exp": iat + JWT_LIFETIME_SECONDS,
             "aud": "/admin/"           # per Ghost Admin API docs
         }
         token = jwt.encode(
@@ -38,7 +54,10 @@ class Ghost:
         # PyJWT returns str on recent versions; ensure we return a str
         auth_token: str = token if isinstance(token, str) else token.decode("utf-8")
 
-        return {"Authorization": f"Ghost {auth_token}"}
+        with self._lock:
+            self._auth_header = {"Authorization": f"Ghost {auth_token}"}
+            self._auth_renew_at = iat + JWT_LIFETIME_SECONDS - JWT_RENEW_MARGIN_SECONDS
+            return self._auth_header
 
 # Removed in favor of onedrive as storage backend:
     # def upload_image(self, image_path: str) -> str:
@@ -77,6 +96,26 @@ class Ghost:
     #         return "upload failed"
 
 
+    def load_post_index(self, slugs: list[str] = None) -> dict:
+        """
+        Fetch the posts we may upsert (all posts, or only `slugs`) in one request, with just
+        the fields an upsert needs, and keep them for the rest of the run.
+        """
+        params = {"fields": "id,slug,updated_at", "limit": "all"}
+        if slugs:
+            params["filter"] = "slug:[" + ",".join(f"'{slug}'" for slug in slugs) + "]"
+
+        resp = requests.get(f"{self.admin_api_url}/posts/", params=params, headers=self._get_ghost_api_auth_header(self.admin_api_key), timeout=30, verify=False)
+        if resp.status_code != 200:
+            raise Exception(f"Failed to load post index: {resp.status_code} {resp.text[:200]}")
+
+        posts = resp.json().get("posts", [])
+        with self._lock:
+            self._post_index = {post["slug"]: post for post in posts}
+        logging.info("Loaded %d posts into the post index", len(posts))
+        return self._post_index
+
+
     def find_post_by_slug(self, slug: str):
         url = f"{self.admin_api_url}/posts/?filter=slug:{json.dumps(slug)}"
         headers = self._get_ghost_api_auth_header(self.admin_api_key)
@@ -132,7 +171,10 @@ class Ghost:
 
 
 
-    def update_existing_post(self, post_id: str, slug: str, html: str):
+    def update_existing_post(self, post_id: str, slug: str, html: str, updated_at: str = None):
+        """
+        With updated_at (from the post index), Ghost rejects the update if the post changed since then.
+        """
         title = self._humanize_title(slug)
 
         url = f"{self.admin_api_url}/posts/{post_id}/?source=html"
@@ -150,26 +192,46 @@ class Ghost:
                 "status": "draft"
             }]
         }
+        if updated_at:
+            body["posts"][0]["updated_at"] = updated_at
 
         resp = requests.put(url, headers=headers, json=body, timeout=30, verify=False)
 
         if 200 <= resp.status_code < 300:
             return resp.json()["posts"][0]
 
+        if resp.status_code == 409:
+            logging.error("Post %s was changed by someone else since it was indexed, not overwriting it", post_id)
+            return None
+
         logging.error("Failed to update post %s: %s %s", post_id, resp.status_code, resp.text[:300])
         return None
 
 
 
     def upsert_post(self, slug: str, html: str):
-        existing = self.find_post_by_slug(slug)
+        """
+        Update the post with this slug, or create it as a draft.
+        After load_post_index() this costs one write and no lookup.
+        """
+        with self._lock:
+            post_index = self._post_index
+        if post_index is not None:
+            existing = post_index.get(slug)
+        else:
+            existing = self.find_post_by_slug(slug)
 
         if existing:
             logging.info("Post '%s' exists (id=%s). Updating.", slug, existing["id"])
-            return self.update_existing_post(existing["id"], slug, html)
+            post = self.update_existing_post(existing["id"], slug, html, existing.get("updated_at"))
+        else:
+            logging.info("Post '%s' does not exist. Creating new draft.", slug)
+            post = self.create_draft_post(slug, html)
 
-        logging.info("Post '%s' does not exist. Creating new draft.", slug)
-        return self.create_draft_post(slug, html)
+        if post and post_index is not None:
+            with self._lock:
+                post_index[slug] = {"id": post["id"], "slug": post["slug"], "updated_at": post.get("updated_at")}
+        return post
 
 
 
@@ -182,6 +244,8 @@ class Ghost:
               - "url"         (required)
               - "caption"     (optional)
               - "description" (optional, used if caption missing)
+              - "width" / "height" (optional, the image's intrinsic size; set on the
+                <img> so the browser reserves its space before it loads)
         """
         html_content: str = ''
 
@@ -190,11 +254,14 @@ class Ghost:
             if isinstance(item, str):
                 url = item
                 caption = None
+                size_attrs = ""
             else:
                 # New shape: dict coming from OneDrive helper:
-                # {"id", "filename", "url", "description", "caption"}
+                # {"id", "filename", "url", "description", "caption", "taken", "width", "height"}
                 url = item.get("url")
                 caption = item.get("caption") or item.get("description")
+                width, height = item.get("width"), item.get("height")
+                size_attrs = f' width="{int(width)}" height="{int(height)}"' if width and height else ""
 
             if not url:
                 # Skip anything malformed
@@ -204,12 +271,12 @@ class Ghost:
                 esc_caption = html.escape(str(caption), quote=True)
                 html_content += (
                     f'<figure>'
-                    f'<img src="{url}" alt="{esc_caption}">'
+                    f'<img src="{url}"{size_attrs} alt="{esc_caption}">'
                     f'<figcaption>{esc_caption}</figcaption>'
                     f'</figure>\n'
                 )
             else:
-                html_content += f"""<p><img src="{url}"></p>\n"""
+                html_content += f"""<p><img src="{url}"{size_attrs}></p>\n"""
 
         return html_content
 
@@ -2,14 +2,278 @@
 # ChatGPT generated
 from __future__ import annotations
 import io
+import os
+import json
+import hashlib
 import logging
+import tempfile
+import threading
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Tuple, Dict
 
+import PIL
+import numpy as np
 from PIL import Image, ImageOps
 
-logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+# Perceptual mode compares luma planes downsampled to about this long edge, in SSIM windows
+# of this size, evaluated every SSIM_STEP pixels (windows overlap, so every pixel still counts).
+SSIM_LONG_EDGE = 800
+SSIM_WINDOW = 7
+SSIM_STEP = 4
+_SSIM_C1 = (0.01 * 255) ** 2
+_SSIM_C2 = (0.03 * 255) ** 2
+
+# Encoder format -> (result key, file extension)
+_FORMAT_KEYS: Dict[str, Tuple[str, str]] = {
+    "WEBP": ("webp", ".webp"),
+    "JPEG": ("jpg", ".jpg"),
+}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """
+    One output of prepare_for_upload.
+      fmt:       "WEBP" or "JPEG"
+      target_kb: size budget, None uses the editor's target_kb
+      min_ssim:  perceptual floor (see ImageEditor), None uses the editor's min_ssim
+      to_disk:   True writes <out_dir>/<stem>[-<name>].<ext>, False returns the encoded bytes
+      name:      result key and file suffix, needed only to plan two renditions of one format
+    """
+    fmt: str
+    target_kb: Optional[int] = None
+    to_disk: bool = True
+    name: Optional[str] = None
+    min_ssim: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        if self.fmt not in _FORMAT_KEYS:
+            raise ValueError(f"Unsupported output format: {self.fmt}")
+
+    @property
+    def key(self) -> str:
+        return self.name or _FORMAT_KEYS[self.fmt][0]
+
+
+@dataclass(frozen=True)
+class OutputPlan:
+    """
+    Which renditions prepare_for_upload encodes. Nothing outside the plan is ever encoded.
+    The optional fallback is encoded only when a consumer calls PreparedImage.fallback().
+    """
+    renditions: Tuple[Rendition, ...]
+    fallback: Optional[Rendition] = None
+
+
+# Old behaviour: WebP and progressive JPEG, both written to out_dir.
+BOTH_FORMATS_PLAN = OutputPlan((Rendition("WEBP"), Rendition("JPEG")))
+# Preferred + fallback: WebP only, JPEG encoded only if someone asks for it.
+WEBP_WITH_JPEG_FALLBACK_PLAN = OutputPlan((Rendition("WEBP"),), fallback=Rendition("JPEG"))
+
+
+def _luma_plane(im: Image.Image) -> np.ndarray:
+    """Luma of im, box-downsampled by an integer factor to about SSIM_LONG_EDGE, as float64."""
+    luma = im.convert("L")
+    factor = max(1, max(luma.size) // SSIM_LONG_EDGE)
+    if factor > 1:
+        luma = luma.reduce(factor)
+    return np.asarray(luma, dtype=np.float64)
+
+
+def _window_means(a: np.ndarray) -> np.ndarray:
+    """Mean of the SSIM_WINDOW x SSIM_WINDOW windows of a, every SSIM_STEP pixels, from a summed-area table."""
+    n, step = SSIM_WINDOW, SSIM_STEP
+    sat = np.zeros((a.shape[0] + 1, a.shape[1] + 1))
+    np.cumsum(a, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    top, bottom = sat[:-n:step], sat[n::step]
+    return (bottom[:, n::step] - top[:, n::step] - bottom[:, :-n:step] + top[:, :-n:step]) / (n * n)
+
+
+class SsimReference:
+    """
+    Window statistics of a reference luma plane (_luma_plane), computed once, to score
+    any number of candidates against it with score().
+    """
+
+    def __init__(self, luma: np.ndarray) -> None:
+        self.luma = luma
+        self.small = min(luma.shape) < SSIM_WINDOW
+        if not self.small:
+            self.mu = _window_means(luma)
+            self.var = _window_means(luma * luma) - self.mu * self.mu
+
+    def score(self, luma: np.ndarray) -> float:
+        """Mean SSIM of luma against the reference (uniform windows)."""
+        if self.small:
+            return 1.0 if np.array_equal(self.luma, luma) else 0.0
+        mu_x, var_x = self.mu, self.var
+        mu_y = _window_means(luma)
+        var_y = _window_means(luma * luma) - mu_y * mu_y
+        cov = _window_means(self.luma * luma) - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + _SSIM_C1) * (2 * cov + _SSIM_C2)) / (
+            (mu_x * mu_x + mu_y * mu_y + _SSIM_C1) * (var_x + var_y + _SSIM_C2)
+        )
+        return float(ssim_map.mean())
+
+
+class EncodeCache:
+    """
+    On-disk LRU cache of final encodings, so re-runs and retries skip decode + quality search.
+
+    Keys are a hash of the source file content plus every encoder setting (see
+    ImageEditor._cache_key). Each entry is one file holding the chosen quality on the
+    first line and the encoded bytes after it. Entries are written to a temp file and
+    renamed into place, so a crash never leaves a truncated entry. A hit bumps the
+    entry's mtime; when the cache grows past max_bytes the oldest entries are evicted.
+    """
+
+    def __init__(self, cache_dir: Path | str, max_bytes: int = 512 * 1024 * 1024) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._total_bytes = sum(p.stat().st_size for p in self._entries())
+
+    @staticmethod
+    def hash_file(path: Path | str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, int]]:
+        """Returns (encoded bytes, quality) or None."""
+        path = self._path(key)
+        try:
+            raw = path.read_bytes()
+            header, data = raw.split(b"\n", 1)
+            quality = int(header)
+            os.utime(path)  # LRU: most recently used = newest mtime
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data, quality
+
+    def put(self, key: str, data: bytes, quality: int) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"%d\n" % quality)
+                f.write(data)
+            previous = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("Failed to write encode cache entry %s: %s", key, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            self._total_bytes += path.stat().st_size - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self._total_bytes,
+            }
+
+    def _evict(self) -> None:
+        # Caller holds the lock. Evict down to 90% of the cap so we don't rescan on every put.
+        entries = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, p in entries:
+            if self._total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def _entries(self):
+        return (p for p in self.cache_dir.glob("*/*") if not p.name.startswith(".tmp-"))
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+
+class PreparedImage(dict):
+    """
+    Result of prepare_for_upload, keyed by rendition key:
+    {
+      "webp": {"path": "optimized/foo.webp", "bytes": 284112, "quality": 82},
+      "thumb": {"data": b"...", "bytes": 20110, "quality": 80},   # to_disk=False
+    }
+    Keeps the resized image (if one was decoded) so the plan's fallback can be produced on
+    demand. If every rendition came from the cache, fallback() decodes the source again,
+    so it must still exist at that point.
+    """
+
+    def __init__(
+        self,
+        editor: "ImageEditor",
+        src: Path,
+        source_hash: Optional[str],
+        fallback: Optional[Rendition],
+    ):
+        super().__init__()
+        self._editor = editor
+        self._src = src
+        self._source_hash = source_hash
+        self._fallback = fallback
+        self._im: Optional[Image.Image] = None
+        self._icc_profile: Optional[bytes] = None
+
+    def fallback(self) -> Optional[Dict[str, int | str | bytes]]:
+        """Produce (once) and return the fallback rendition, or None if the plan has none."""
+        if self._fallback is None:
+            return None
+        if self._fallback.key not in self:
+            out = self._editor._cached_rendition(self._fallback, self._src.stem, self._source_hash)
+            if out is None:
+                if self._im is None:
+                    self._im, self._icc_profile = self._editor._load_for_encoding(self._src)
+                out = self._editor._encode_rendition(
+                    self._im, self._fallback, self._src.stem, self._icc_profile,
+                    self._editor.candidates_per_image, self._source_hash,
+                )
+            self[self._fallback.key] = out
+        return self[self._fallback.key]
+
+    def release(self) -> None:
+        """Drop the resized image; fallback() is no longer available afterwards."""
+        self._im = None
+        self._fallback = None
 
 
 class ImageEditor:
@@ -17,8 +281,17 @@ class ImageEditor:
     Prepare a single source photo for web upload:
     - EXIF orientation fix
     - High-quality downscale (LANCZOS)
-    - Save WebP + progressive JPEG under target size
+    - Save the renditions of the output plan (by default WebP + progressive JPEG) under target size
     - Preserve ICC profile (avoid color shifts), strip heavy EXIF
+
+    All planned renditions are searched concurrently, and each search encodes several
+    candidate qualities per round. Pillow releases the GIL while encoding, so on a
+    multi-core host this costs roughly the wall time of the slowest rendition.
+
+    With min_ssim set, a rendition gets the lowest quality whose encoding keeps at least
+    that SSIM against the resized image (compared on a downsampled luma plane), so simple
+    scenes stop spending bytes they don't need. The target size remains a ceiling: if that
+    quality doesn't fit, the highest quality that does is used, as without min_ssim.
     """
 
     def __init__(
@@ -31,24 +304,43 @@ class ImageEditor:
         webp_quality_range: Tuple[int, int] = (60, 95),
         jpeg_subsampling: int = 2,        # 4:2:0 = 2 (good tradeoff for photos)
         jpeg_progressive: bool = True,
+        max_workers: Optional[int] = None,  # encoder threads, defaults to the CPU count
+        concurrent_images: int = 1,  # images the caller prepares at once, they split the encoder threads
+        output_plan: OutputPlan = BOTH_FORMATS_PLAN,
+        cache_dir: Optional[Path | str] = None,  # enables the on-disk encode cache
+        cache_max_mb: int = 512,
+        min_ssim: Optional[float] = None,  # e.g. 0.98 enables perceptual rate control
     ) -> None:
         self.out_dir = Path(out_dir)
         self.max_long_edge = max_long_edge
         self.target_bytes = target_kb * 1024
+        self.min_ssim = min_ssim
         self.jpeg_q_range = (jpeg_min_quality, jpeg_max_quality)
         self.webp_q_range = webp_quality_range
         self.jpeg_subsampling = jpeg_subsampling
         self.jpeg_progressive = jpeg_progressive
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Quality candidates one image tries per search round. More than its share of the threads only
+        # adds speculative encodes that queue behind the other images' and don't finish it any sooner.
+        self.candidates_per_image = max(1, self.max_workers // max(1, concurrent_images))
+        self.output_plan = output_plan
+        self.cache = EncodeCache(cache_dir, cache_max_mb * 1024 * 1024) if cache_dir else None
+
+        # Two pools so a rendition search never waits on candidate encodes queued behind it in its own pool.
+        self._format_pool: Optional[ThreadPoolExecutor] = None
+        self._encode_pool: Optional[ThreadPoolExecutor] = None
+        self._pools_lock = threading.Lock()  # the editor is shared by photo threads that may all start at once
 
         self.out_dir.mkdir(parents=True, exist_ok=True)
 
     # ---------- Public API ----------
-    def prepare_for_upload(self, image_path: str | Path) -> Dict[str, Dict[str, int | str]]:
+    def prepare_for_upload(self, image_path: str | Path) -> PreparedImage:
         """
-        Process ONE image and write outputs to self.out_dir:
+        Process ONE image and produce the renditions of self.output_plan.
+        With the default plan that writes to self.out_dir:
           - <name>.webp
           - <name>.jpg
-        Returns a dict with output paths & chosen qualities/sizes.
+        Returns a PreparedImage (a dict) with output paths or bytes & chosen qualities/sizes.
 
         Example:
         {
@@ -57,6 +349,78 @@ class ImageEditor:
         }
         """
         src = Path(image_path)
+        stem = src.stem
+        renditions = self.output_plan.renditions
+        source_hash = self.cache.hash_file(src) if self.cache else None
+        result = PreparedImage(self, src, source_hash, self.output_plan.fallback)
+
+        for rendition in renditions:
+            cached = self._cached_rendition(rendition, stem, source_hash)
+            if cached is not None:
+                result[rendition.key] = cached
+        missing = [rendition for rendition in renditions if rendition.key not in result]
+
+        # Decode only if the cache didn't have everything.
+        if missing:
+            im, icc = self._load_for_encoding(src)
+            result._im, result._icc_profile = im, icc
+
+            # Split the encoder threads between the renditions that run side by side.
+            candidates_per_round = max(1, self.candidates_per_image // len(missing))
+            if len(missing) == 1:
+                # Nothing to run side by side, so encode on the calling thread.
+                result[missing[0].key] = self._encode_rendition(im, missing[0], stem, icc, candidates_per_round, source_hash)
+            else:
+                format_pool, _ = self._get_pools()
+                futures = [
+                    (rendition, format_pool.submit(
+                        self._encode_rendition, im, rendition, stem, icc, candidates_per_round, source_hash
+                    ))
+                    for rendition in missing
+                ]
+                for rendition, future in futures:
+                    result[rendition.key] = future.result()
+
+        logging.debug(
+            "%s → %s",
+            src.name,
+            ", ".join(f"{key} ({out['bytes'] // 1024} KB, q={out['quality']})" for key, out in result.items()),
+        )
+
+        return result
+
+    @property
+    def cache_stats(self) -> Optional[Dict[str, int]]:
+        """Encode cache hit/miss/eviction counters and size, or None if caching is off."""
+        return self.cache.stats() if self.cache else None
+
+    def close(self) -> None:
+        """Shut down the encoder threads. The editor can still be used afterwards, they are recreated on demand."""
+        with self._pools_lock:
+            pools = (self._format_pool, self._encode_pool)
+            self._format_pool = self._encode_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def __enter__(self) -> "ImageEditor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # ---------- Internals ----------
+    def _get_pools(self) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        with self._pools_lock:
+            if self._format_pool is None:
+                self._format_pool = ThreadPoolExecutor(
+                    max_workers=max(2, len(self.output_plan.renditions)), thread_name_prefix="image-format"
+                )
+                self._encode_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-encode")
+            return self._format_pool, self._encode_pool
+
+    def _load_for_encoding(self, src: Path) -> Tuple[Image.Image, Optional[bytes]]:
+        """Decode, orient, convert and downscale the source. Returns (image, ICC profile)."""
         im = self._load_image_safe(src)
         if im is None:
             raise FileNotFoundError(f"Could not open or decode image: {src}")
@@ -68,30 +432,8 @@ class ImageEditor:
 
         # Downscale with high-quality filter
         im = self._resize_for_web(im, self.max_long_edge)
+        return im, icc
 
-        stem = src.stem
-        webp_path = self.out_dir / f"{stem}.webp"
-        jpg_path = self.out_dir / f"{stem}.jpg"
-
-        webp_bytes, webp_q = self._save_under_target(
-            im, webp_path, "WEBP", self.target_bytes, icc, self.webp_q_range
-        )
-        jpg_bytes, jpg_q = self._save_under_target(
-            im, jpg_path, "JPEG", self.target_bytes, icc, self.jpeg_q_range
-        )
-
-        logging.info(
-            "%s → %s (%d KB, q=%d), %s (%d KB, q=%d)",
-            src.name, webp_path.name, webp_bytes // 1024, webp_q,
-            jpg_path.name, jpg_bytes // 1024, jpg_q
-        )
-
-        return {
-            "webp": {"path": str(webp_path), "bytes": webp_bytes, "quality": webp_q},
-            "jpg":  {"path": str(jpg_path),  "bytes": jpg_bytes,  "quality": jpg_q},
-        }
-
-    # ---------- Internals ----------
     def _load_image_safe(self, path: Path) -> Optional[Image.Image]:
         try:
             im = Image.open(path)
@@ -118,6 +460,9 @@ class ImageEditor:
         quality: int,
         icc_profile: Optional[bytes],
     ) -> bytes:
+        # Image.save() keeps per-call encoder settings on the Image object, so concurrent
+        # encodes each get their own wrapper around the shared pixel core (no pixel copy).
+        im = im._new(im.im)
         buf = io.BytesIO()
         params = {"quality": quality, "optimize": True}
         if icc_profile:
@@ -127,7 +472,7 @@ class ImageEditor:
             params.update({"format": "WEBP", "method": 6})
             im.save(buf, **params)
         elif fmt == "JPEG":
-            im_rgb = im.convert("RGB")
+            im_rgb = im if im.mode == "RGB" else im.convert("RGB")
             params.update({
                 "format": "JPEG",
                 "subsampling": self.jpeg_subsampling,
@@ -148,21 +493,33 @@ class ImageEditor:
         q_hi: int,
         icc_profile: Optional[bytes],
         max_iters: int = 12,
+        candidates_per_round: int = 1,
     ) -> Tuple[bytes, int]:
+        """
+        Find the highest quality in [q_lo, q_hi] whose encoding fits target_bytes.
+
+        Each round speculatively encodes `candidates_per_round` evenly spaced qualities
+        in parallel (a k-ary search). With one candidate this is a plain binary search.
+        """
         best_data = None
         best_q = q_lo
+        lo_data = None  # encoding at q_lo, kept for the fallback below
         lo, hi = q_lo, q_hi
 
         for _ in range(max_iters):
-            q = (lo + hi) // 2
-            data = self._encode_to_bytes(im, fmt, q, icc_profile)
-            size = len(data)
+            qualities = self._candidate_qualities(lo, hi, candidates_per_round)
+            results = self._run_candidates(self._encode_to_bytes, im, fmt, qualities, icc_profile)
 
-            if size <= target_bytes:
-                best_data, best_q = data, q
-                lo = q + 1
-            else:
-                hi = q - 1
+            # Size grows with quality, so everything up to the last fit fits, everything after it doesn't.
+            for q, data in results:
+                if q == q_lo:
+                    lo_data = data
+                if len(data) <= target_bytes:
+                    best_data, best_q = data, q
+                    lo = q + 1
+                else:
+                    hi = q - 1
+                    break
 
             if lo > hi:
                 break
@@ -172,19 +529,184 @@ class ImageEditor:
 
         # Couldn’t hit target; return smallest feasible quality
         q = max(q_lo, min(q_hi, hi))
+        if q == q_lo and lo_data is not None:
+            return lo_data, q
         data = self._encode_to_bytes(im, fmt, q, icc_profile)
         return data, q
 
-    def _save_under_target(
+    def _perceptual_search_quality(
         self,
         im: Image.Image,
-        out_path: Path,
         fmt: str,
+        min_ssim: float,
         target_bytes: int,
+        q_lo: int,
+        q_hi: int,
+        icc_profile: Optional[bytes],
+        max_iters: int = 12,
+        candidates_per_round: int = 1,
+    ) -> Tuple[bytes, int]:
+        """
+        Find the lowest quality in [q_lo, q_hi] whose encoding scores at least min_ssim against im.
+        If that encoding is over target_bytes, fall back to the highest quality below it that fits.
+        Same k-ary search as _binary_search_quality; SSIM grows with quality the way size does.
+        The sizes of the candidates encoded along the way narrow down that fallback search.
+        """
+        reference = SsimReference(_luma_plane(im))
+
+        def encode_and_score(im, fmt, q, icc_profile):
+            data = self._encode_to_bytes(im, fmt, q, icc_profile)
+            with Image.open(io.BytesIO(data)) as decoded:
+                return data, reference.score(_luma_plane(decoded))
+
+        best = None  # (data, quality, ssim)
+        hi_data = None  # encoding at q_hi, used if nothing reaches min_ssim
+        fit = None  # (data, quality) of the highest quality seen that fits target_bytes
+        over_q = q_hi + 1  # lowest quality seen that doesn't fit
+        lo, hi = q_lo, q_hi
+
+        for _ in range(max_iters):
+            qualities = self._candidate_qualities(lo, hi, candidates_per_round)
+            results = self._run_candidates(encode_and_score, im, fmt, qualities, icc_profile)
+
+            for q, (data, _) in results:
+                if len(data) > target_bytes:
+                    over_q = min(over_q, q)
+                elif fit is None or q > fit[1]:
+                    fit = (data, q)
+
+            # Everything from the first candidate that passes up passes, everything before it doesn't.
+            for q, (data, score) in results:
+                if q == q_hi:
+                    hi_data = data
+                if score >= min_ssim:
+                    best = (data, q, score)
+                    hi = q - 1
+                    break
+                lo = q + 1
+
+            if lo > hi:
+                break
+
+        if best is None:
+            data = hi_data if hi_data is not None else self._encode_to_bytes(im, fmt, q_hi, icc_profile)
+            best = (data, q_hi, None)
+        data, q, score = best
+        logging.debug("%s: q=%d reaches SSIM %s in %d bytes", fmt, q, f"{score:.4f}" if score is not None else f"< {min_ssim}", len(data))
+        if len(data) <= target_bytes:
+            return data, q
+
+        # Over the ceiling: the highest quality that fits, searching only between the sizes already seen.
+        lo = fit[1] + 1 if fit else q_lo
+        hi = min(q, over_q) - 1
+        if lo <= hi:
+            data, q = self._binary_search_quality(
+                im, fmt, target_bytes, lo, hi, icc_profile, max_iters=max_iters, candidates_per_round=candidates_per_round,
+            )
+            if len(data) <= target_bytes or fit is None:
+                return data, q
+        if fit is not None:
+            return fit
+        # Not even q_lo fits; like _binary_search_quality, settle for the smallest.
+        return self._binary_search_quality(im, fmt, target_bytes, q_lo, q_lo, icc_profile)
+
+    def _run_candidates(self, encode, im: Image.Image, fmt: str, qualities: list[int], icc_profile: Optional[bytes]) -> list:
+        """[(quality, encode(im, fmt, quality, icc_profile))], one candidate inline, several on the encode pool."""
+        if len(qualities) == 1:
+            return [(qualities[0], encode(im, fmt, qualities[0], icc_profile))]
+        _, encode_pool = self._get_pools()
+        futures = [(q, encode_pool.submit(encode, im, fmt, q, icc_profile)) for q in qualities]
+        return [(q, f.result()) for q, f in futures]
+
+    @staticmethod
+    def _candidate_qualities(lo: int, hi: int, count: int) -> list[int]:
+        """Up to `count` distinct qualities splitting [lo, hi] into even parts, ascending."""
+        if hi - lo + 1 <= count:
+            return list(range(lo, hi + 1))
+        return sorted({lo + (hi - lo) * (i + 1) // (count + 1) for i in range(count)})
+
+    def _target_bytes(self, rendition: Rendition) -> int:
+        return rendition.target_kb * 1024 if rendition.target_kb else self.target_bytes
+
+    def _min_ssim(self, rendition: Rendition) -> Optional[float]:
+        return rendition.min_ssim if rendition.min_ssim is not None else self.min_ssim
+
+    def _q_range(self, rendition: Rendition) -> Tuple[int, int]:
+        return self.webp_q_range if rendition.fmt == "WEBP" else self.jpeg_q_range
+
+    def _out_path(self, rendition: Rendition, stem: str) -> Path:
+        suffix = f"-{rendition.name}" if rendition.name else ""
+        return self.out_dir / f"{stem}{suffix}{_FORMAT_KEYS[rendition.fmt][1]}"
+
+    def _cache_key(self, source_hash: str, rendition: Rendition) -> str:
+        # Everything that can change the encoded bytes, so a settings change is a miss, never a stale hit.
+        params = {
+            "source": source_hash,
+            "fmt": rendition.fmt,
+            "target_bytes": self._target_bytes(rendition),
+            "q_range": self._q_range(rendition),
+            "max_long_edge": self.max_long_edge,
+            "jpeg_subsampling": self.jpeg_subsampling,
+            "jpeg_progressive": self.jpeg_progressive,
+            "webp_method": 6,
+            "pillow": PIL.__version__,
+        }
+        if self._min_ssim(rendition) is not None:
+            # Only in the key when set, so byte-budget entries from before perceptual mode stay valid.
+            params.update({
+                "min_ssim": self._min_ssim(rendition),
+                "ssim_long_edge": SSIM_LONG_EDGE, "ssim_window": SSIM_WINDOW, "ssim_step": SSIM_STEP,
+            })
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def _cached_rendition(
+        self, rendition: Rendition, stem: str, source_hash: Optional[str]
+    ) -> Optional[Dict[str, int | str | bytes]]:
+        if self.cache is None or source_hash is None:
+            return None
+        entry = self.cache.get(self._cache_key(source_hash, rendition))
+        if entry is None:
+            return None
+        data, q = entry
+        if not rendition.to_disk:
+            return {"data": data, "bytes": len(data), "quality": q}
+        out_path = self._out_path(rendition, stem)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(data)
+        return {"path": str(out_path), "bytes": len(data), "quality": q}
+
+    def _encode_rendition(
+        self,
+        im: Image.Image,
+        rendition: Rendition,
+        stem: str,
         icc_profile: Optional[bytes],
-        q_range: Tuple[int, int],
-    ) -> Tuple[int, int]:
-        data, q = self._binary_search_quality(im, fmt, target_bytes, q_range[0], q_range[1], icc_profile)
+        candidates_per_round: int,
+        source_hash: Optional[str] = None,
+    ) -> Dict[str, int | str | bytes]:
+        if rendition.fmt == "JPEG" and im.mode != "RGB":
+            # The JPEG encoder needs RGB; convert once here instead of once per candidate.
+            im = im.convert("RGB")
+        q_range = self._q_range(rendition)
+        min_ssim = self._min_ssim(rendition)
+
+        if min_ssim is not None:
+            data, q = self._perceptual_search_quality(
+                im, rendition.fmt, min_ssim, self._target_bytes(rendition), q_range[0], q_range[1], icc_profile,
+                candidates_per_round=candidates_per_round,
+            )
+        else:
+            data, q = self._binary_search_quality(
+                im, rendition.fmt, self._target_bytes(rendition), q_range[0], q_range[1], icc_profile,
+                candidates_per_round=candidates_per_round,
+            )
+        if self.cache is not None and source_hash is not None:
+            self.cache.put(self._cache_key(source_hash, rendition), data, q)
+
+        if not rendition.to_disk:
+            return {"data": data, "bytes": len(data), "quality": q}
+
+        out_path = self._out_path(rendition, stem)
         out_path.parent.mkdir(parents=True, exist_ok=True)
         out_path.write_bytes(data)
-        return len(data), q
\ No newline at end of file
+        return {"path": str(out_path), "bytes": len(data), "quality": q}
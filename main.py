@@ -1,81 +1,721 @@
 #!python3
+# Heavy modules (ghost, onedrive, image_editor and through them msal, PyJWT/cryptography,
+# requests and Pillow) are imported inside the subcommands that need them, so that cheap
+# commands like `status` don't pay for them on every invocation.
 import os
+import sys
+import json
+import time
 import logging
+import heapq
+import argparse
 import datetime
+import threading
 import settings
-from ghost import Ghost
-from onedrive import Onedrive
-from image_editor import ImageEditor
+import profiling
 
 
-def get_this_months_photos(all_onedrive_photos_info):
-    this_month = datetime.datetime.now().strftime("%Y%m")
-    this_months_photos = {}
+def get_photos_by_month(all_onedrive_photos_info, first_month=None, last_month=None):
+    """
+    Partition photos by the 'YYYYMM' prefix of their file name.
+    first_month / last_month ('YYYYMM', inclusive) optionally limit the months kept.
+    """
+    photos_by_month = {}
 
     for photo_name, photo_full_data in all_onedrive_photos_info.items():
-        if photo_name.startswith(this_month):
-            this_months_photos[photo_name] = photo_full_data
-
-    return this_months_photos
-
-
-def main():
-    # Change prints() to logging
-    config = settings.init_settings()
-    onedrive = Onedrive(config)
-    all_onedrive_photos_info = onedrive.get_photos_information()
-
-    this_months_photos = get_this_months_photos(all_onedrive_photos_info)
-    
-    # Reset all photos to unsynced for testing purpose
-    #onedrive.reset_photos_for_month(this_months_photos)
-    #exit()
-    
-    this_months_unsynced_photos = onedrive.get_photos_to_sync_list(this_months_photos)
-
-    logging.info(f"Ensuring monthly folder exists in OneDrive")
-    if not onedrive.ensure_monthly_folder_exists():
-        logging.error(f"Failed to ensure monthly folder {config['onedrive_upload_endpoint']} exists in OneDrive.")
-        raise Exception("Failed to ensure folder exists in OneDrive.")
-    
-    # We only init these classes here so as not to put more memory pressure on the system while it is busy with onedrive tasks.
-    ghost = Ghost(os.environ['GHOST_ADMIN_URL'],  os.environ['GHOST_ADMIN_API_KEY'])
-    image_editor = ImageEditor(out_dir=config["output_dir"], max_long_edge=1600, target_kb=300)
+        month = photo_name[:6]
+        if not month.isdigit():
+            continue
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        photos_by_month.setdefault(month, {})[photo_name] = photo_full_data
+
+    return photos_by_month
+
+
+def get_months_photos(all_onedrive_photos_info, month):
+    return get_photos_by_month(all_onedrive_photos_info, month, month).get(month, {})
+
+
+def get_this_months_photos(all_onedrive_photos_info):
+    return get_months_photos(all_onedrive_photos_info, datetime.datetime.now().strftime("%Y%m"))
+
+
+def parse_month(value: str) -> str:
+    """
+    argparse type for months: accepts 'YYYY-MM' or 'YYYYMM', returns 'YYYYMM'.
+    """
+    try:
+        return datetime.datetime.strptime(value.replace("-", ""), "%Y%m").strftime("%Y%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid month '{value}', expected YYYY-MM")
+
+
+def month_slug(month):
+    """
+    'YYYYMM' -> the post slug 'MM-YYYY'.
+    """
+    return f"{month[4:]}-{month[:4]}"
+
+
+def get_ghost():
+    from ghost import Ghost
+
+    return Ghost(os.environ['GHOST_ADMIN_URL'],  os.environ['GHOST_ADMIN_API_KEY'])
+
+
+class RunBudget:
+    """
+    Wall clock budget of a sync run (seconds=None: unlimited). A photo is only started while
+    there is time left to finish it, judged by the slowest photo so far, and still publish
+    the posts, for which reserve_seconds are kept (10% of the budget, at least 30s).
+    Photos that aren't started stay unsynced and are picked up by the next run.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.reserve_seconds = max(30, seconds * 0.1) if seconds else 0
+        self.slowest_photo = 0
+        self.skipped = 0
+        self.skipped_months = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.deadline - time.monotonic() if self.deadline else float("inf")
+
+    def allows_photo(self):
+        with self._lock:
+            allowed = self.remaining() > self.reserve_seconds + self.slowest_photo
+            if not allowed:
+                self.skipped += 1
+            return allowed
+
+    def allows_month(self):
+        # A month's plan stage reads every photo's sync status, not worth it without time for a photo.
+        with self._lock:
+            allowed = self.remaining() > self.reserve_seconds + self.slowest_photo
+            if not allowed:
+                self.skipped_months += 1
+            return allowed
+
+    def record_photo(self, seconds):
+        with self._lock:
+            self.slowest_photo = max(self.slowest_photo, seconds)
+
+
+class NewestFirstPool:
+    """
+    Thread pool that, whenever a worker frees up, starts the newest pending photo of all the
+    months that submitted work to it (largest capture key), rather than the oldest submission.
+    Jobs submitted without a capture key, like a month's plan work, go ahead of all photos.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix=""):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._pending = []  # heap of (rank, _NewestKey, sequence, future, fn, args)
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, capture_key=None):
+        from concurrent.futures import Future
+
+        future = Future()
+        with self._lock:
+            self._sequence += 1
+            rank = (1, _NewestKey(capture_key)) if capture_key is not None else (0, _NewestKey(""))
+            heapq.heappush(self._pending, (*rank, self._sequence, future, fn, args))
+        # Each worker run starts whatever is on top of the heap by then, not necessarily this job.
+        self._pool.submit(self._run_next)
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+    def _run_next(self):
+        with self._lock:
+            *_, future, fn, args = heapq.heappop(self._pending)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as ex:
+            future.set_exception(ex)
+
+
+class _NewestKey:
+    """Heap key that orders larger (newer) capture keys first."""
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+def run_budget(args, config):
+    """
+    The RunBudget of a sync run: --deadline, else RUN_DEADLINE_MINUTES, in minutes (0 = none).
+    """
+    minutes = getattr(args, "deadline", None)
+    if minutes is None:
+        minutes = config["run_deadline_minutes"]
+    return RunBudget(minutes * 60 if minutes else None)
+
+
+def photo_capture_key(photo_name, photo_file_data):
+    """
+    Sort key by capture time: photo.takenDateTime from the listing, else the time in the file name.
+    """
+    from onedrive import capture_time
+
+    return (capture_time(photo_name, photo_file_data.get("taken")), photo_name)
+
+
+def newest_first(photos):
+    """
+    Photos ordered by capture time, newest first.
+    """
+    return dict(sorted(photos.items(), key=lambda item: photo_capture_key(*item), reverse=True))
+
+
+def connect_sources(config):
+    """
+    One OneDrive client per photo source (see settings.load_sources), each with its own token
+    cache and request rate. The first one also owns the web folder the renditions go to.
+    All of them share one bandwidth limiter, so DOWNLOAD_MAX_KBPS caps the run as a whole.
+    Only the first source has to connect; any other that can't (e.g. its token expired) is
+    logged and left out of this run.
+    """
+    from onedrive import Onedrive
+    from downloader import BandwidthLimiter
+
+    bandwidth_limiter = BandwidthLimiter(config["download_max_kbps"] * 1024)
+    publisher_config, *other_configs = settings.load_sources(config)
+    sources = [Onedrive(publisher_config, bandwidth_limiter)]
+    for source_config in other_configs:
+        try:
+            sources.append(Onedrive(source_config, bandwidth_limiter))
+        except Exception as ex:
+            logging.error(f"Failed to connect source {source_config['source_name']}, skipping it this run: {ex}")
+    return sources
+
+
+def list_sources(sources):
+    """
+    List every source's camera folder, in parallel, and merge their photos into one dict.
+    Photos of the second and later sources get a '-<source>' suffix on their name, so two phones'
+    photos with the same name don't collide in the downloads or the web folder. Every photo
+    keeps its client in photo_file_data['source'].
+    With several sources, one that fails to list is logged and left out of this run.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if len(sources) == 1:
+        listings = [(sources[0], sources[0].get_photos_information())]
+    else:
+        listings = []
+        with ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="list") as pool:
+            futures = [(source, pool.submit(source.get_photos_information)) for source in sources]
+            for source, future in futures:
+                try:
+                    listings.append((source, future.result()))
+                except Exception as ex:
+                    logging.error(f"Failed to list photos of source {source.name}: {ex}")
+
+    all_photos = {}
+    for source, photos in listings:
+        for photo_name, photo_file_data in photos.items():
+            if source is not sources[0]:
+                stem, ext = os.path.splitext(photo_name)
+                photo_name = f"{stem}-{source.name.lower()}{ext}"
+            all_photos[photo_name] = {**photo_file_data, "source": source}
+    return all_photos
+
+
+def photos_by_source(onedrive, photos):
+    """
+    Split photos by the client of their source; photos without one belong to onedrive.
+    """
+    grouped = {}
+    for photo_name, photo_file_data in photos.items():
+        grouped.setdefault(photo_file_data.get("source", onedrive), {})[photo_name] = photo_file_data
+    return grouped
+
+
+def log_stage(stage, month, started, **counts):
+    """
+    One INFO summary record per pipeline stage; per-photo details are logged at DEBUG.
+    """
+    seconds = round(time.monotonic() - started, 2)
+    logging.info(
+        "Month %s: %s stage done in %.2fs (%s)", month, stage, seconds, ", ".join(f"{k}={v}" for k, v in counts.items()),
+        extra={"stage": stage, "month": month, "seconds": seconds, **counts},
+    )
+
+
+def rebuild_post(config, onedrive, ghost=None):
+    """
+    Rebuild a month's Ghost post from whatever is currently in that month's web folder.
+    Pass a shared ghost when rebuilding several months, so its post index and token are reused.
+    Returns the post, or None if Ghost didn't take the update (already logged).
+    """
+    started = time.monotonic()
+    ghost = ghost or get_ghost()
+    with profiling.stage(f"{config['month']}-post"):
+        # In capture time order, with each photo's size, straight from the folder listing.
+        all_uploaded_image_urls_and_captions = onedrive.get_public_urls_and_captions_for_photos_in_folder(config["onedrive_upload_endpoint"])
+
+        draft_post_html = ghost.prepare_draft_post_html(all_uploaded_image_urls_and_captions)
+        logging.debug("-------------------------------------------------------------------------------- Prepared draft post HTML content:\n%s\n--------------------------------------------------------------------------------\n", draft_post_html)
+        post = ghost.upsert_post(month_slug(config["month"]), draft_post_html)
+    if post is None:
+        logging.error(f"Post {month_slug(config['month'])} was not updated")
+        return None
+    logging.info(f"Created new draft post: {post['url']}")
+    log_stage("post", config["month"], started, gallery_size=len(all_uploaded_image_urls_and_captions))
+    return post
 
-    for photo_name, photo_file_data in this_months_unsynced_photos.items():
-        logging.info(f"Photo to sync: {photo_name}")
-        photo_local_file_name: str = onedrive.download_file(photo_file_data['download_url'], photo_name, config["download_dir"])
-        photo_webp_file_name: str = f"{config['output_dir']}/{photo_local_file_name.rsplit('.', 1)[0]}.webp"
 
+def rendition_name(photo_name):
+    """
+    Name of the web rendition sync_photo uploads for a source photo.
+    """
+    return f"{os.path.splitext(photo_name)[0]}.webp"
 
-        image_editor.prepare_for_upload(f"{config["download_dir"]}/{photo_local_file_name}")
-        #uploaded_photo_url = ghost.upload_image(photo_webp_file_name)
 
-        upload_status = onedrive.upload_file(photo_webp_file_name, config["onedrive_upload_endpoint"])
-        if upload_status != "upload ok":
+def sync_photo(config, onedrive, image_editor, photo_name, photo_file_data, budget=None):
+    """
+    Download, optimize and upload one photo. Returns whether the upload succeeded, or None if
+    the run's budget was spent before it started. A photo that fails is logged and left unsynced,
+    it never stops the rest of the month.
+    The photo is read from its source's account and published through onedrive.
+    """
+    if budget is not None and not budget.allows_photo():
+        logging.debug("Out of time, leaving %s for the next run", photo_name)
+        return None
+    started = time.monotonic()
+    logging.debug("Photo to sync: %s", photo_name)
+    source = photo_file_data.get("source", onedrive)
+    photo_local_path = f"{config['download_dir']}/{photo_name}"
+    photo_webp_file_name = None
+    try:
+        source.download_file(
+            photo_file_data['download_url'], photo_name, config["download_dir"],
+            file_id=photo_file_data['id'], hashes=photo_file_data.get('hashes'), size=photo_file_data.get('size'),
+        )
+
+        prepared = image_editor.prepare_for_upload(photo_local_path)
+        photo_webp_file_name: str = prepared["webp"]["path"]
+
+        rendition_id = onedrive.upload_file(photo_webp_file_name, config["onedrive_upload_endpoint"])
+        if rendition_id is None:
             logging.error(f"Failed to upload photo {photo_name} to OneDrive. Skipping marking as synced.")
         else:
-            onedrive.set_kv_metadata_file_description(photo_file_data['id'], 'sync_status', 'synced')
-            
-        # if uploaded_photo_url == "upload failed":
-        #     logging.error(f"Failed to upload photo {photo_name} to Ghost. Skipping marking as synced.")
-        # else:
-        #     logging.info(f"Uploaded photo URL: {uploaded_photo_url}")
-        #     all_uploaded_image_urls.append(uploaded_photo_url)
-
-        os.remove(f"{config["output_dir"]}/{photo_local_file_name.rsplit('.', 1)[0]}.jpg")
-        os.remove(f"{config["download_dir"]}/{photo_local_file_name}")
-        os.remove(photo_webp_file_name)
-    
-    all_uploaded_image_urls_and_captions = onedrive.get_public_urls_and_captions_for_photos_in_folder(config["onedrive_upload_endpoint"])
-
-    draft_post_html = ghost.prepare_draft_post_html(all_uploaded_image_urls_and_captions)
-    logging.info("-------------------------------------------------------------------------------- Prepared draft post HTML content:\n" + draft_post_html + '\n--------------------------------------------------------------------------------\n')
-    this_month = datetime.datetime.now().strftime("%m-%Y")
-    post = ghost.upsert_post(this_month, draft_post_html)
-    logging.info(f"Created new draft post: {post['url']}")
-   
+            # Queued, sync_month writes all of them in batches once the photos are done. The rendition
+            # keeps the source's capture time, the gallery is ordered by it.
+            source.metadata_writer.set(photo_file_data['id'], 'sync_status', 'synced')
+            if photo_file_data.get("taken"):
+                onedrive.metadata_writer.set(rendition_id, 'taken', photo_file_data["taken"])
+                photo_file_data["rendition_id"] = rendition_id
+    except Exception as ex:
+        logging.error(f"Failed to sync photo {photo_name}, leaving it for the next run: {ex}")
+        rendition_id = None
+    finally:
+        for path in (photo_local_path, photo_webp_file_name):
+            if path and os.path.exists(path):
+                os.remove(path)
 
-if __name__  == '__main__':
-    main()
+    if budget is not None:
+        budget.record_photo(time.monotonic() - started)
+    return rendition_id is not None
+
+
+def flush_month_metadata(onedrive, months_photos):
+    failed = []
+    for source, source_photos in photos_by_source(onedrive, months_photos).items():
+        failed += source.metadata_writer.flush([photo_file_data['id'] for photo_file_data in source_photos.values()])
+    rendition_ids = [photo_file_data["rendition_id"] for photo_file_data in months_photos.values() if "rendition_id" in photo_file_data]
+    failed_renditions = onedrive.metadata_writer.flush(rendition_ids) if rendition_ids else []
+    if failed_renditions:
+        # Not fatal either: those photos sort by their file name in the post.
+        logging.error(f"Failed to store the capture time of {len(failed_renditions)} renditions")
+    if failed:
+        # Not fatal: their renditions are published, so the next run's destination listing marks them synced.
+        logging.error(f"Failed to mark {len(failed)} photos as synced")
+
+
+def sync_month(config, onedrive, image_editor, months_photos, photo_pools=None, ghost=None, budget=None):
+    """
+    Sync one month's photos, from all sources, into its web folder on onedrive, then upsert that month's post.
+    With photo_pools ({source client: NewestFirstPool}) each source's photos are processed on its own pool,
+    sharing its workers with other months.
+    A photo that fails doesn't stop the others, and the post is rebuilt from whatever was published.
+    In pool mode each source's photos start as soon as that source's sync status is read, and only
+    the post waits for all of them. Photos go newest first. Under a RunBudget the month is skipped if it can't start in time, and once
+    it started, photos stop being started as time runs out, but the post is always rebuilt from what made it.
+    Returns the post, or None if the month was skipped.
+    """
+    from concurrent.futures import wait
+
+    if budget is not None and not budget.allows_month():
+        logging.info(f"Out of time, leaving month {config['month']} for the next run")
+        return None
+
+    def plan_source(source, source_photos):
+        unsynced_photos = source.get_photos_to_sync_list(source_photos)
+        already_published = 0
+        if destination_index and not config.get("reprocess"):
+            for photo_name, photo_file_data in list(unsynced_photos.items()):
+                if destination_index.get(rendition_name(photo_name), 0) > 0:
+                    logging.debug("%s is already published, marking %s as synced", rendition_name(photo_name), photo_name)
+                    source.metadata_writer.set(photo_file_data['id'], 'sync_status', 'synced')
+                    del unsynced_photos[photo_name]
+                    already_published += 1
+        return unsynced_photos, already_published
+
+    def plan_and_submit_source(source, source_photos):
+        unsynced_photos, already_published = plan_source(source, source_photos)
+        photo_futures = [
+            photo_pools[source].submit(
+                sync_photo, config, onedrive, image_editor, photo_name, photo_file_data, budget,
+                capture_key=photo_capture_key(photo_name, photo_file_data),
+            )
+            for photo_name, photo_file_data in unsynced_photos.items()
+        ]
+        return photo_futures, already_published
+
+    sources_photos = photos_by_source(onedrive, months_photos)
+    started = time.monotonic()
+    with profiling.stage(f"{config['month']}-plan"):
+        # One listing of the destination up front. A rendition that is already there was uploaded by an
+        # earlier run whose sync_status write failed, so we only mark its source synced (unless --reprocess).
+        destination_index = onedrive.list_folder(config["onedrive_web_endpoint"])
+        logging.info(f"Ensuring monthly folder exists in OneDrive")
+        if not onedrive.ensure_monthly_folder_exists(config["onedrive_upload_endpoint"], destination_index):
+            logging.error(f"Failed to ensure monthly folder {config['onedrive_upload_endpoint']} exists in OneDrive.")
+            raise Exception("Failed to ensure folder exists in OneDrive.")
+
+        months_unsynced_photos = {}
+        already_published = 0
+        if photo_pools is None:
+            for source, source_photos in sources_photos.items():
+                unsynced_photos, published = plan_source(source, source_photos)
+                months_unsynced_photos.update(unsynced_photos)
+                already_published += published
+
+    if photo_pools is None:
+        months_unsynced_photos = newest_first(months_unsynced_photos)
+        log_stage("plan", config["month"], started, photos=len(months_photos), to_sync=len(months_unsynced_photos), already_published=already_published)
+        started = time.monotonic()
+
+    results = []
+    to_sync = len(months_unsynced_photos)
+    failed_plans = []
+    try:
+        if photo_pools is None:
+            with profiling.stage(f"{config['month']}-photos"):
+                for photo_name, photo_file_data in months_unsynced_photos.items():
+                    results.append(sync_photo(config, onedrive, image_editor, photo_name, photo_file_data, budget))
+        else:
+            # Sync status is read per photo, so each account reads its own on its own workers, and
+            # queues its photos right after: a throttled account only delays its own photos.
+            plan_futures = {source: photo_pools[source].submit(plan_and_submit_source, source, source_photos) for source, source_photos in sources_photos.items()}
+            photo_futures = []
+            for source, plan_future in plan_futures.items():
+                try:
+                    source_photo_futures, published = plan_future.result()
+                except Exception as ex:
+                    logging.error(f"Failed to plan the photos of source {source.name or source.config['onedrive_camera_path']}: {ex}")
+                    failed_plans.append(ex)
+                    continue
+                photo_futures += source_photo_futures
+                already_published += published
+            to_sync = len(photo_futures)
+            log_stage(
+                "plan", config["month"], started,
+                photos=len(months_photos), to_sync=to_sync, already_published=already_published, failed_sources=len(failed_plans),
+            )
+
+            started = time.monotonic()
+            # Every photo job has to be done before the flush, or its sync_status would be queued after it.
+            wait(photo_futures)
+            for future in photo_futures:
+                results.append(future.result())
+    finally:
+        # End of the photo stage, also after a failure, so the photos that did make it are marked synced.
+        flush_month_metadata(onedrive, months_photos)
+        log_stage(
+            "photos", config["month"], started,
+            uploaded=results.count(True), failed=results.count(False), out_of_time=results.count(None),
+            not_done=to_sync - len(results),
+        )
+
+    post = rebuild_post(config, onedrive, ghost)
+    if post is None:
+        raise Exception(f"Failed to update post {month_slug(config['month'])}")
+    if failed_plans:
+        raise Exception(f"Failed to plan the photos of {len(failed_plans)} sources, the post only has the others")
+    return post
+
+
+def sync_months(config, sources, photos_by_month, workers=1, budget=None):
+    """
+    Sync several months from the given sources (connect_sources) into the first source's web folder.
+    With workers > 1 or several sources the months run concurrently, and each source's photos
+    share one pool of threads: its configured worker share, or an even share of `workers`.
+    The total load stays the same no matter how many months are in flight, and a slow or
+    throttled account only holds up its own photos. Months start newest first, so under a
+    RunBudget it is the oldest work that carries over to the next run. Returns the months that failed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from image_editor import ImageEditor, WEBP_WITH_JPEG_FALLBACK_PLAN
+
+    # We only init these classes here so as not to put more memory pressure on the system while it is busy with onedrive tasks.
+    # Only the WebP is uploaded, so the JPEG is never encoded unless something asks for the fallback.
+    # The encode cache makes re-runs and retries of a photo cost a hash and a cache lookup.
+    # With min_ssim the quality is the lowest that looks the same, and 300 KB only a ceiling.
+    # cProfile only sees the thread it runs on, so under --profile everything stays on the main thread.
+    if profiling.enabled():
+        workers = 1
+    serial = (workers <= 1 and len(sources) == 1) or profiling.enabled() or len(photos_by_month) == 0
+    source_workers = {source: source.config["source_workers"] or max(1, workers // len(sources)) for source in sources}
+    # Photos that run side by side share the encoder threads, rather than each searching with all of them.
+    image_editor = ImageEditor(
+        out_dir=config["output_dir"], max_long_edge=1600, target_kb=300, output_plan=WEBP_WITH_JPEG_FALLBACK_PLAN,
+        cache_dir=config["encode_cache_dir"], cache_max_mb=config["encode_cache_max_mb"], min_ssim=config["min_ssim"],
+        max_workers=1 if profiling.enabled() else None, concurrent_images=1 if serial else sum(source_workers.values()),
+    )
+    failed_months = []
+
+    # One Ghost client and one post lookup for all months, instead of a lookup per post.
+    ghost = get_ghost()
+    if len(photos_by_month) > 1:
+        try:
+            ghost.load_post_index([month_slug(month) for month in photos_by_month])
+        except Exception as ex:
+            logging.warning(f"{ex}, falling back to one lookup per post")
+
+    onedrive = sources[0]
+    if serial:
+        for month, months_photos in sorted(photos_by_month.items(), reverse=True):
+            try:
+                sync_month(settings.month_settings(config, month), onedrive, image_editor, months_photos, ghost=ghost, budget=budget)
+            except Exception as ex:
+                logging.error(f"Failed to sync month {month}: {ex}")
+                failed_months.append(month)
+    else:
+        photo_pools = {
+            source: NewestFirstPool(
+                max_workers=source_workers[source],
+                thread_name_prefix=f"photo-{source.name}" if source.name else "photo",
+            )
+            for source in sources
+        }
+        try:
+            # Month jobs only wait on photo jobs, so they get their own pool and can't starve the photo pools.
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(photos_by_month))), thread_name_prefix="month") as month_pool:
+                futures = {
+                    month: month_pool.submit(
+                        sync_month, settings.month_settings(config, month), onedrive, image_editor, months_photos, photo_pools, ghost, budget
+                    )
+                    for month, months_photos in sorted(photos_by_month.items(), reverse=True)
+                }
+                for month, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        logging.error(f"Failed to sync month {month}: {ex}")
+                        failed_months.append(month)
+        finally:
+            for photo_pool in photo_pools.values():
+                photo_pool.shutdown()
+
+    image_editor.close()
+    logging.info(f"Encode cache stats: {image_editor.cache_stats}")
+    if budget is not None and (budget.skipped or budget.skipped_months):
+        logging.info(f"Run budget spent, {budget.skipped} photos and {budget.skipped_months} whole months left for the next run")
+    return failed_months
+
+
+def cmd_sync(args, config):
+    budget = run_budget(args, config)
+    sources = connect_sources(config)
+    with profiling.stage("list"):
+        this_months_photos = get_months_photos(list_sources(sources), config["month"])
+    failed_months = sync_months(config, sources, {config["month"]: this_months_photos}, budget=budget)
+    return 1 if failed_months else 0
+
+
+def cmd_backfill(args, config):
+    """
+    Catch up a range of months: list the camera folder once, partition by month and
+    sync the months concurrently, with one post upsert per month.
+    """
+    last_month = args.to_month or config["month"]
+    if args.from_month > last_month:
+        logging.error(f"Backfill range is empty: {args.from_month} > {last_month}")
+        return 2
 
+    budget = run_budget(args, config)
+    sources = connect_sources(config)
+    with profiling.stage("list"):
+        photos_by_month = get_photos_by_month(list_sources(sources), args.from_month, last_month)
+    logging.info(f"Backfilling {len(photos_by_month)} months with photos between {args.from_month} and {last_month}")
+
+    failed_months = sync_months(config, sources, photos_by_month, workers=args.workers or config["backfill_workers"], budget=budget)
+    return 1 if failed_months else 0
+
+
+def cmd_list(args, config):
+    this_months_photos = get_months_photos(list_sources(connect_sources(config)), config["month"])
+
+    for photo_name, photo_file_data in sorted(this_months_photos.items()):
+        source = photo_file_data["source"]
+        sync_status = source.check_metadata_for_sync_status(photo_file_data['id'])
+        print(f"{sync_status:<18} {source.name + ':' if source.name else ''}{photo_file_data['filename']}")
+    print(f"{len(this_months_photos)} photos in {config['month']}")
+    return 0
+
+
+def cmd_status(args, config):
+    """
+    Report local state only. No network calls, no third party imports.
+    """
+    print(f"month folder:   {config['onedrive_web_path']}/{datetime.datetime.now().strftime('%Y/%m')}")
+    try:
+        sources = settings.load_sources(config)
+    except Exception as ex:
+        print(f"sources:        unreadable ({ex})")
+        sources = []
+
+    for source in sources:
+        if source["source_name"]:
+            print(f"source:         {source['source_name']}")
+        print(f"camera folder:  {source['onedrive_camera_path']}")
+
+        token_cache_path = source["token_cache_path"]
+        if not os.path.exists(token_cache_path):
+            print(f"token cache:    missing ({token_cache_path}), run any network command, e.g. `list`, to log in")
+            continue
+        try:
+            with open(token_cache_path) as f:
+                cache = json.load(f)
+            usernames = [a.get("username", "?") for a in cache.get("Account", {}).values()]
+            expiries = [int(t.get("expires_on", 0)) for t in cache.get("AccessToken", {}).values()]
+            expires = datetime.datetime.fromtimestamp(max(expiries)).isoformat(sep=" ") if expiries else "n/a"
+            print(f"token cache:    {', '.join(usernames) or 'no accounts'} (access token expires {expires})")
+        except (OSError, ValueError) as ex:
+            print(f"token cache:    unreadable ({ex})")
+
+    for label, key in (("downloads:", "download_dir"), ("optimized:", "output_dir")):
+        path = config[key]
+        leftover = os.listdir(path) if os.path.isdir(path) else []
+        print(f"{label:<15} {len(leftover)} leftover files in {path}")
+
+    cache_dir = config["encode_cache_dir"]
+    cache_files = [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+    cache_mb = sum(os.path.getsize(path) for path in cache_files) / (1024 * 1024)
+    print(f"encode cache:   {len(cache_files)} entries, {cache_mb:.1f} / {config['encode_cache_max_mb']} MB in {cache_dir}")
+
+    for var in ("CLIENT_ID", "GHOST_ADMIN_URL", "GHOST_ADMIN_API_KEY"):
+        print(f"{var + ':':<15} {'set' if os.getenv(var) else 'NOT SET'}")
+    return 0
+
+
+def cmd_rebuild_post(args, config):
+    from onedrive import Onedrive
+
+    # The web folder belongs to the first source's account, the others aren't needed.
+    post = rebuild_post(config, Onedrive(settings.load_sources(config)[0]))
+    return 0 if post else 1
+
+
+def cmd_reset_month(args, config):
+    """
+    Reset all of a month's photos to unsynced. A plain sync re-marks the ones whose rendition is
+    still in the web folder as synced; `sync --reprocess` re-processes all of them.
+    """
+    sources = connect_sources(config)
+    this_months_photos = get_months_photos(list_sources(sources), config["month"])
+    if not args.yes:
+        answer = input(f"Reset {len(this_months_photos)} photos to unsynced? [y/N] ")
+        if answer.strip().lower() != "y":
+            print("Aborted.")
+            return 1
+    for source, source_photos in photos_by_source(sources[0], this_months_photos).items():
+        source.reset_photos_for_month(source_photos)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ghost-onedrive-sync", description="Sync photos from OneDrive into a Ghost blog.")
+    parser.add_argument(
+        "--profile", nargs="?", const="profiles", metavar="DIR",
+        help="profile each stage (cProfile + tracemalloc) on a single worker and write the results to DIR (default: profiles)",
+    )
+    parser.add_argument("--profile-top", type=int, default=25, metavar="N", help="functions and allocation sites listed per stage in the profile report (default: 25)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    # sync and backfill can be given a time budget; what doesn't fit is left for the next run.
+    run_parser = argparse.ArgumentParser(add_help=False)
+    run_parser.add_argument(
+        "--deadline", type=float, metavar="MINUTES",
+        help="stop starting new photos in time to publish the posts within MINUTES, newest photos first (default: RUN_DEADLINE_MINUTES, or none)",
+    )
+    run_parser.add_argument(
+        "--reprocess", action="store_true",
+        help="process every unsynced photo, even if its web rendition already exists (use after reset-month)",
+    )
+
+    subparsers.add_parser(
+        "sync", parents=[run_parser], help="download, optimize and upload this month's unsynced photos, then rebuild the post (default)",
+    ).set_defaults(func=cmd_sync)
+    backfill_parser = subparsers.add_parser("backfill", parents=[run_parser], help="sync every month in a range, several months at a time")
+    backfill_parser.add_argument("--from", dest="from_month", type=parse_month, required=True, help="first month, YYYY-MM")
+    backfill_parser.add_argument("--to", dest="to_month", type=parse_month, help="last month, YYYY-MM (default: this month)")
+    backfill_parser.add_argument("--workers", type=int, help="photos processed at once across all months (default: BACKFILL_WORKERS or 4)")
+    backfill_parser.set_defaults(func=cmd_backfill)
+    # list, rebuild-post and reset-month work on this month unless given --month.
+    month_parser = argparse.ArgumentParser(add_help=False)
+    month_parser.add_argument("--month", type=parse_month, help="month to work on, YYYY-MM (default: this month)")
+
+    subparsers.add_parser("list", parents=[month_parser], help="list a month's photos and their sync status").set_defaults(func=cmd_list)
+    subparsers.add_parser("status", help="show local configuration and state, without touching the network").set_defaults(func=cmd_status)
+    subparsers.add_parser("rebuild-post", parents=[month_parser], help="rebuild a month's Ghost post from the web optimized folder").set_defaults(func=cmd_rebuild_post)
+    reset_parser = subparsers.add_parser(
+        "reset-month", parents=[month_parser],
+        help="mark all of a month's photos as unsynced; run sync --reprocess next, or photos whose web rendition still exists are only re-marked synced",
+    )
+    reset_parser.add_argument("-y", "--yes", action="store_true", help="don't ask for confirmation")
+    reset_parser.set_defaults(func=cmd_reset_month)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    # Running with no subcommand keeps the old behaviour (e.g. from cron).
+    func = getattr(args, "func", cmd_sync)
+    config = settings.init_settings(log_to_file=func is not cmd_status)
+    if getattr(args, "month", None):
+        config = settings.month_settings(config, args.month)
+    config["reprocess"] = getattr(args, "reprocess", False)
+    if not args.profile:
+        return func(args, config)
+
+    profiling.start(os.path.join(args.profile, datetime.datetime.now().strftime("%Y%m%d-%H%M%S")), args.profile_top)
+    try:
+        return func(args, config)
+    finally:
+        logging.info(f"Profile report written to {profiling.stop()}")
+
+
+if __name__  == '__main__':
+    sys.exit(main())
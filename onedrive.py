@@ -1,9 +1,13 @@
 import os
+import time
 import msal
 import requests
 import logging
+import re
 import json
+import threading
 from html import unescape
+from downloader import Downloader, BandwidthLimiter
 from urllib.parse import urlparse, parse_qs, urlencode
 
 
@@ -11,22 +15,235 @@ from urllib.parse import urlparse, parse_qs, urlencode
 PHOTO_FILE_EXTENSIONS = (".jpg", ".jpeg", ".webp",)
 FILE_SYNCED_METADATA_KEY = 'sync_status' # should contain 'synced', 'unsynced', or not exist. Uploads as url encoded.
 PHOTO_CAPTION_METADTA_KEY = 'caption' # should contain the caption for the photo, or not exist. NOT url encoded.
+RENDITION_TAKEN_METADATA_KEY = 'taken' # on a web rendition: its source photo's capture time, see capture_time()
+GRAPH_BATCH_LIMIT = 20  # max requests per Graph $batch call
+# Listing fields: photo.takenDateTime, image.width/height and file.hashes come with the listing, no download needed.
+PHOTO_LISTING_SELECT = "id,name,size,description,file,photo,image,@microsoft.graph.downloadUrl"
+_CAMERA_NAME_TIME = re.compile(r"^(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})")
+
+
+def parse_kv_description(description: str) -> dict:
+    """
+    Parse a file description holding our JSON key-value metadata.
+    A plain text description (typed by hand in OneDrive) is kept as the caption, so merging never loses it.
+    """
+    if not description:
+        return {}
+    try:
+        parsed = json.loads(unescape(description))
+    except json.JSONDecodeError:
+        return {PHOTO_CAPTION_METADTA_KEY: description}
+    return parsed if isinstance(parsed, dict) else {PHOTO_CAPTION_METADTA_KEY: description}
+
+
+def capture_time(name: str, taken: str = None) -> str:
+    """
+    When a photo was taken, as an ISO 8601 string that sorts chronologically: Graph's
+    photo.takenDateTime if the listing had it, else read from a camera style 'YYYYMMDD_HHMMSS'
+    file name, else '' (sorts as oldest).
+    """
+    if taken:
+        return taken
+    match = _CAMERA_NAME_TIME.match(name)
+    if not match:
+        return ""
+    year, month, day, hour, minute, second = match.groups()
+    return f"{year}-{month}-{day}T{hour}:{minute}:{second}Z"
+
+
+def retry_after_seconds(value, default: int) -> int:
+    """
+    Seconds to wait from a Retry-After header. Only the delay-seconds form is used; an HTTP date
+    or a missing header gives default.
+    """
+    value = str(value or "").strip()
+    return int(value) if value.isdigit() else default
+
+
+def photo_facets(item: dict) -> dict:
+    """
+    Capture time and intrinsic size of a listed item, from its photo and image facets.
+    width / height are None when Graph didn't provide them.
+    """
+    image = item.get("image") or {}
+    return {
+        "taken": capture_time(item.get("name", ""), (item.get("photo") or {}).get("takenDateTime")),
+        "width": image.get("width"),
+        "height": image.get("height"),
+    }
+
+
+class GraphSession(requests.Session):
+    """
+    HTTP session of one account. Spaces its requests out to requests_per_second (0 = unlimited)
+    and waits out 429 / 503 answers for as long as their Retry-After asks. Every account has
+    its own, so a throttled account only slows down its own work.
+    """
+
+    def __init__(self, requests_per_second: float = 0, max_throttled_retries: int = 4):
+        super().__init__()
+        self.limiter = BandwidthLimiter(requests_per_second)  # a token bucket of requests rather than bytes
+        self.max_throttled_retries = max_throttled_retries
+
+    def request(self, method, url, *args, **kwargs):
+        # A file body is consumed by the first attempt, so those are not retried here.
+        retryable = not hasattr(kwargs.get("data"), "read")
+        for attempt in range(1, self.max_throttled_retries + 2):
+            self.limiter.consume(1)
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code not in (429, 503) or not retryable or attempt > self.max_throttled_retries:
+                return response
+            wait = retry_after_seconds(response.headers.get("Retry-After"), 2 ** attempt)
+            logging.warning(f"Throttled by OneDrive ({response.status_code}), retrying in {wait}s")
+            response.close()
+            time.sleep(min(wait, 60))
+
+
+class MetadataWriter:
+    """
+    Queues key-value metadata updates per file and writes them in Graph $batch PATCHes.
+    Updates are merged into the file's existing description, so setting sync_status keeps the caption.
+    Descriptions the Onedrive class has already read are reused; unknown ones are fetched (also batched) first.
+    Call flush() at the end of each pipeline stage.
+    """
+
+    def __init__(self, onedrive: "Onedrive", max_attempts: int = 4):
+        self.onedrive = onedrive
+        self.max_attempts = max_attempts
+        self._pending = {}  # file id -> {key: value}
+        self._lock = threading.Lock()
+
+    def set(self, file_id: str, data_key: str, data_value: str) -> None:
+        with self._lock:
+            self._pending.setdefault(file_id, {})[data_key] = data_value
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self, file_ids: list = None) -> list:
+        """
+        Write queued updates (all of them, or only those for file_ids).
+        Returns the ids that still failed after retries; their updates are dropped.
+        """
+        with self._lock:
+            file_ids = list(self._pending) if file_ids is None else [i for i in file_ids if i in self._pending]
+            updates = {file_id: self._pending.pop(file_id) for file_id in file_ids}
+        if not updates:
+            return []
+
+        unknown = [file_id for file_id in updates if file_id not in self.onedrive.known_descriptions]
+        if unknown:
+            for file_id, response in self._send_batch([
+                {"id": file_id, "method": "GET", "url": f"{self.onedrive.graph_item_path(file_id)}?$select=id,description"}
+                for file_id in unknown
+            ]).items():
+                if response.get("status") == 200:
+                    self.onedrive.known_descriptions[file_id] = (response.get("body") or {}).get("description") or ""
+
+        requests_by_id = {}
+        failed = []
+        for file_id, kv in updates.items():
+            if file_id not in self.onedrive.known_descriptions:
+                # Writing without knowing the current description could clobber a caption.
+                logging.error(f"Could not read current metadata of file {file_id}, not writing {kv}")
+                failed.append(file_id)
+                continue
+            merged = parse_kv_description(self.onedrive.known_descriptions[file_id])
+            merged.update(kv)
+            requests_by_id[file_id] = {
+                "id": file_id,
+                "method": "PATCH",
+                "url": self.onedrive.graph_item_path(file_id),
+                "headers": {"Content-Type": "application/json"},
+                "body": {"description": json.dumps(merged)},
+            }
+
+        for file_id, response in self._send_batch(list(requests_by_id.values())).items():
+            if response.get("status") == 200:
+                self.onedrive.known_descriptions[file_id] = requests_by_id[file_id]["body"]["description"]
+            else:
+                logging.error(f"Failed to write metadata to file {file_id}: {response.get('status')} {response.get('body')}")
+                failed.append(file_id)
+
+        logging.info(f"Wrote metadata for {len(updates) - len(failed)} files, {len(failed)} failed")
+        return failed
+
+    def _send_batch(self, batch_requests: list) -> dict:
+        """
+        Send requests through Graph $batch, GRAPH_BATCH_LIMIT at a time, retrying throttled
+        or failed items. Returns {request id: final response}.
+        """
+        headers = {
+            "Authorization": f"Bearer {self.onedrive.access_token}",
+            "Content-Type": "application/json",
+        }
+        results = {}
+        remaining = list(batch_requests)
+
+        for attempt in range(1, self.max_attempts + 1):
+            retry, wait = [], 0
+            for start in range(0, len(remaining), GRAPH_BATCH_LIMIT):
+                chunk = remaining[start:start + GRAPH_BATCH_LIMIT]
+                try:
+                    resp = self.onedrive.http.post(self.onedrive.graph_batch_url, headers=headers, json={"requests": chunk}, timeout=60)
+                    responses = resp.json().get("responses", []) if resp.status_code == 200 else []
+                except (requests.exceptions.RequestException, ValueError) as ex:
+                    logging.warning(f"Metadata batch request failed (attempt {attempt}): {ex}")
+                    responses = []
+
+                by_id = {r.get("id"): r for r in responses}
+                for request in chunk:
+                    response = by_id.get(request["id"], {"status": None})
+                    status = response.get("status")
+                    if status is None or status == 429 or status >= 500:
+                        retry.append(request)
+                        wait = max(wait, retry_after_seconds((response.get("headers") or {}).get("Retry-After"), 2 ** attempt))
+                    results[request["id"]] = response
+
+            if not retry:
+                break
+            if attempt < self.max_attempts:
+                time.sleep(min(wait, 60))
+            remaining = retry
+
+        return results
+
 
 class Onedrive:
     """
     Class to handle OneDrive operations
     """
 
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, bandwidth_limiter: BandwidthLimiter = None):
+        """
+        Pass one bandwidth_limiter to the clients of all sources, so DOWNLOAD_MAX_KBPS caps them together.
+        """
         logging.info('Starting OneDrive class init')
         self.config = config
+        self.name = config.get("source_name", "")
+        self.http = GraphSession(config.get("graph_requests_per_second", 0))
         self.msal_app = self._initialize_msal_app(config)
 
-        self.access_token = None
-        self.access_token = self._get_access_token(self.msal_app, self.config["scopes"], self.config["token_cache_path"])
-        if not self.access_token:
+        self._token_lock = threading.Lock()
+        if not self._get_access_token(self.msal_app, self.config["scopes"], self.config["token_cache_path"]):
             self._interactive_login(self.msal_app, self.config["scopes"], self.config["token_cache_path"])
 
+        # Descriptions read so far (file id -> raw description), so metadata writes can merge without re-reading.
+        self.known_descriptions = {}
+        self.metadata_writer = MetadataWriter(self)
+        graph_root, _, principal = self.config["onedrive_baseurl"].rpartition("/")
+        self.graph_batch_url = f"{graph_root}/$batch"
+        self._graph_principal = principal
+
+        # One downloader for the whole run, so parallel downloads share its bandwidth cap.
+        self.downloader = Downloader(
+            refresh_url=self.get_download_url,
+            session=self.http,
+            max_bytes_per_sec=self.config.get("source_download_max_kbps", 0) * 1024,
+            shared_limiter=bandwidth_limiter or BandwidthLimiter(self.config.get("download_max_kbps", 0) * 1024),
+        )
+
     def _initialize_msal_app(self, config: dict) -> msal.ConfidentialClientApplication:
         logging.info('Initializing MSAL app instance')
         """
@@ -45,8 +262,14 @@ class Onedrive:
         """
         # One-time interactive login (run this once)
         flow = app.initiate_device_flow(scopes=scopes_list)
+        if "user_code" not in flow:
+            raise Exception(f"Failed to start the device login: {flow.get('error_description', flow)}")
         logging.info(f"Visit: {flow['verification_uri']}\nEnter code: {flow['user_code']}")
+        # The log only goes to the file, and someone has to type this code.
+        print(flow["message"], flush=True)
         result = app.acquire_token_by_device_flow(flow)
+        if "access_token" not in result:
+            raise Exception(f"Device login failed: {result.get('error_description', result)}")
 
         # Save refresh token to file
         with open(cache_path, "w") as f:
@@ -54,19 +277,39 @@ class Onedrive:
         
         return result
     
-    def _get_access_token(self, app: msal.PublicClientApplication, scopes_list: list, cache_path: str) -> str:
+    def _get_access_token(self, app: msal.PublicClientApplication, scopes_list: list, cache_path: str) -> str | None:
+        """
+        Access token from the token cache file, or None if there is no cache or no account in it yet
+        (the caller then logs in interactively, which creates it).
+        """
+        if not os.path.exists(cache_path):
+            return None
         # Load cached tokens
-        app.token_cache.deserialize(open(cache_path).read())
-
-        accounts = app.get_accounts()
-        if accounts:
-            # Silent token acquisition using refresh token
-            result = app.acquire_token_silent(
-                scopes=scopes_list, 
-                account=accounts[0]
-            )
-            return result["access_token"]
-        raise Exception("No valid token cached. Re-run interactive login.")   
+        with open(cache_path) as f:
+            app.token_cache.deserialize(f.read())
+        if not app.get_accounts():
+            return None
+        return self.access_token
+
+    @property
+    def access_token(self) -> str:
+        """
+        The account's access token, read per request since a run can outlast its ~1 h lifetime.
+        MSAL hands out the cached token until it is about to expire, then redeems the refresh token.
+        """
+        with self._token_lock:
+            accounts = self.msal_app.get_accounts()
+            if accounts:
+                # Silent token acquisition using refresh token
+                result = self.msal_app.acquire_token_silent(scopes=self.config["scopes"], account=accounts[0])
+                if result and "access_token" in result:
+                    if self.msal_app.token_cache.has_state_changed:
+                        # Save the renewed tokens, so the next run starts from them.
+                        with open(self.config["token_cache_path"], "w") as f:
+                            f.write(self.msal_app.token_cache.serialize())
+                        self.msal_app.token_cache.has_state_changed = False
+                    return result["access_token"]
+            raise Exception("No valid token cached. Re-run interactive login.")
 
 
     ############################# End of init and helper functions #############################
@@ -77,11 +320,11 @@ class Onedrive:
         headers = {"Authorization": f"Bearer {self.access_token}"}
         all_files = []
         # Graph API only returns 200 items at a time, so we need to loop through the pages, using a field called "@odata.nextLink" to get the next page of results.  
-        next_link = self.config["onedrive_camera_endpoint"]
+        next_link = f"{self.config['onedrive_camera_endpoint']}?$select={PHOTO_LISTING_SELECT}&$top=1000"
 
         while next_link:
             try:
-                response = requests.get(next_link, headers=headers)
+                response = self.http.get(next_link, headers=headers)
                 
                 if response.status_code != 200:
                     logging.error(f"Error: {response.status_code}, {response.text}")
@@ -116,6 +359,9 @@ class Onedrive:
                     "filename": item["name"],
                     "id": item["id"],
                     "download_url": item.get("@microsoft.graph.downloadUrl", ""),
+                    "size": item.get("size"),
+                    "hashes": (item.get("file") or {}).get("hashes", {}),
+                    **photo_facets(item),
                 }
 
         
@@ -138,13 +384,13 @@ class Onedrive:
 
 
     def get_photos_to_sync_list(self, files):
-        logging.info('Getting photos to sync list')
+        logging.debug('Getting photos to sync list')
 
         files_to_sync = {}
         for filename, file_data in files.items():
             try:
                 sync_status = self.check_metadata_for_sync_status(file_data['id'])
-                logging.info(f"File: {filename}, Sync status: {sync_status}")
+                logging.debug("File: %s, Sync status: %s", filename, sync_status)
                 if sync_status != "synced":
                     files_to_sync[filename] = file_data
             except Exception as e:
@@ -153,34 +399,29 @@ class Onedrive:
         return files_to_sync
 
     
+    def graph_item_path(self, file_id: str) -> str:
+        """
+        Item path relative to the Graph root, as $batch requests need it.
+        """
+        return f"/{self._graph_principal}/drive/items/{file_id}"
+
+
     def set_kv_metadata_file_description(self, file_id: str, data_key: str, data_value: str) -> None:
         """
-        Add a key-value metadata to the file description.
+        Add a key-value metadata to the file description, keeping the other keys, and write it now.
+        To write many files, queue them with self.metadata_writer.set() and flush() once instead.
         """
-        logging.info(f'Adding metadata {data_key}: {data_value} to file {file_id}')
-        
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
-        
-        metadata_endpoint = f"{self.config['onedrive_baseurl']}/drive/items/{file_id}"
-        
-        metadata_payload = {
-            "description": json.dumps({data_key: data_value})
-        }
-        
-        response = requests.patch(metadata_endpoint, headers=headers, json=metadata_payload)
-        
-        if response.status_code != 200:
-            raise Exception(f"Failed to add metadata to file. Error: {response.status_code}, {response.text}")
-        
+        logging.debug('Adding metadata %s: %s to file %s', data_key, data_value, file_id)
+        self.metadata_writer.set(file_id, data_key, data_value)
+        if self.metadata_writer.flush([file_id]):
+            raise Exception(f"Failed to add metadata to file {file_id}")
+
 
     def get_kv_metadata_file_description(self, file_id: str, data_key: str) -> str:
         """
         Get a key-value metadata from the file description.
         """
-        logging.info(f'Getting metadata {data_key} from file {file_id}')
+        logging.debug('Getting metadata %s from file %s', data_key, file_id)
         
         headers = {
             "Authorization": f"Bearer {self.access_token}",
@@ -189,46 +430,45 @@ class Onedrive:
         
         metadata_endpoint = f"{self.config['onedrive_baseurl']}/drive/items/{file_id}"
         
-        response = requests.get(metadata_endpoint, headers=headers)
+        response = self.http.get(metadata_endpoint, headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get metadata from file. Error: {response.status_code}, {response.text}")
         
         metadata = response.json()
-        description = metadata.get("description", "{}")
-        
-        try:
-            description_dict = json.loads(unescape(description))
-            return description_dict.get(data_key, "")
-        
+        description = metadata.get("description") or ""
+        self.known_descriptions[file_id] = description
 
-        except json.JSONDecodeError:
-            return ""
+        return parse_kv_description(description).get(data_key, "")
         
 
-    @staticmethod
-    def download_file(download_url: str, filename: str, download_dir: str) -> str:
-        os.makedirs(download_dir, exist_ok=True)
-        logging.info(f'Downloading file from {download_url}')
-        # Always stream large downloads
-        response = requests.get(download_url, stream=True)
-
-        if response.status_code == 200:
-            with open(f"{download_dir}/{filename}", "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:  # skip keep-alive chunks
-                        f.write(chunk)
-            logging.info(f"{filename} download completed.")
-        else:
-            print("Failed to download:", response.status_code, response.text)
-        
+    def download_file(self, download_url: str, filename: str, download_dir: str, file_id: str = None, hashes: dict = None, size: int = None) -> str:
+        """
+        Download a file, resuming a previous partial download if there is one.
+        With file_id the download URL is refreshed if it expired, and with hashes / size
+        the result is verified. Raises if the file could not be downloaded intact.
+        """
+        logging.debug('Downloading file %s', filename)
+        self.downloader.download(download_url, f"{download_dir}/{filename}", file_id=file_id, hashes=hashes, size=size)
+        logging.debug("%s download completed.", filename)
         return filename
-    
-    
-    def upload_file(self, local_image_path: str, upload_url_base: str) -> str:
+
+
+    def get_download_url(self, file_id: str) -> str:
+        """
+        Get a fresh pre-authenticated download URL; they expire after about an hour.
+        """
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.http.get(f"{self.config['onedrive_baseurl']}/drive/items/{file_id}", headers=headers, timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Failed to get download URL for file. Error: {response.status_code}, {response.text}")
+        return response.json()["@microsoft.graph.downloadUrl"]
+
+
+    def upload_file(self, local_image_path: str, upload_url_base: str) -> str | None:
         """
         Uploads an image file to designated folder in OneDrive using personal Graph API.
-        Returns 'upload ok' on success; otherwise logs the filename and API error and returns 'upload failed'.
+        Returns the uploaded item's id on success; otherwise logs the filename and API error and returns None.
         NOTE: destination_folder (string) is ignored in favor of the pre-existing config['onedrive_web_path'].
         """
         headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/octet-stream"}
@@ -239,28 +479,57 @@ class Onedrive:
         try:
 
             with open(local_image_path, "rb") as fh:
-                resp = requests.put(upload_url, headers=headers, data=fh)
+                resp = self.http.put(upload_url, headers=headers, data=fh)
 
             if resp.status_code in (200, 201):
-                logging.info(f"Uploaded {filename} successfully.")
-                return "upload ok"
+                logging.debug("Uploaded %s successfully.", filename)
+                return resp.json()["id"]
 
             logging.error(f"Upload failed for {filename}: {resp.status_code} {resp.text}")
-            return "upload failed"
+            return None
 
         except Exception as ex:
             logging.error(f"Upload failed for {filename}: {ex}")
-            return "upload failed"
+            return None
 
 
-    def ensure_monthly_folder_exists(self) -> bool:
+    def list_folder(self, children_endpoint: str) -> dict | None:
+        """
+        List a folder once, as an index of lowercased file name -> size in bytes.
+        Returns None if the folder does not exist yet.
+        """
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        folder_index = {}
+        next_link = f"{children_endpoint}?$select=name,size&$top=1000"
+
+        while next_link:
+            response = self.http.get(next_link, headers=headers, timeout=30)
+            if response.status_code == 404:
+                return None
+            if response.status_code != 200:
+                raise Exception(f"Failed to list folder. Error: {response.status_code}, {response.text}")
+
+            data = response.json()
+            for item in data.get("value", []):
+                folder_index[item["name"].lower()] = item.get("size", 0)
+            next_link = data.get("@odata.nextLink")
+
+        return folder_index
+
+
+    def ensure_monthly_folder_exists(self, upload_url_base: str = None, folder_index: dict = None) -> bool:
         """
         Creates the monthly folder chain if it does not exist,
         by uploading an empty .keep file to that path.
+        Defaults to the current month's folder from config.
+        Pass the folder's index from list_folder() to skip the upload when the folder is already there.
         """
-        url = f"{self.config['onedrive_upload_endpoint']}/.keep:/content"
+        if folder_index is not None:
+            return True
+        upload_url_base = upload_url_base or self.config['onedrive_upload_endpoint']
+        url = f"{upload_url_base}/.keep:/content"
         headers = {"Authorization": f"Bearer {self.access_token}"}
-        resp = requests.put(url, headers=headers, data=b"")
+        resp = self.http.put(url, headers=headers, data=b"")
         if resp.status_code not in (200, 201):
             logging.error(f"Failed to ensure monthly folder exists: {resp.status_code} {resp.text}")
             return False
@@ -271,7 +540,7 @@ class Onedrive:
     # ChatGPT Generated
     def get_public_urls_and_captions_for_photos_in_folder(self, upload_url_base: str) -> list:
         """
-        Returns a list of dicts, one per photo file in the folder.
+        Returns a list of dicts, one per photo file in the folder, in capture time order.
 
         Each dict has:
         {
@@ -280,8 +549,15 @@ class Onedrive:
             "url":         <public URL suitable for <img src="">>,
             "description": <OneDrive description field or "">,
             "caption":     <caption from metadata or None>,
+            "taken":       <capture time of the source photo, see capture_time()>,
+            "width":       <pixel width from the image facet, or None>,
+            "height":      <pixel height from the image facet, or None>,
         }
 
+        Descriptions, capture times and sizes all come with the folder listing ($select),
+        so the only request per photo is the share link. The capture time is the one sync_photo
+        stored in the rendition's description, since a WebP rendition has no EXIF for Graph to read.
+
         The 'url' is built from a OneDrive sharing link and should stay valid
         until you revoke or change sharing on the item (unlike
         @microsoft.graph.downloadUrl which expires in ~1 hour).
@@ -303,7 +579,7 @@ class Onedrive:
 
             # Resolve folder metadata
             folder_url = f"{base}"
-            folder_resp = requests.get(folder_url, headers=headers)
+            folder_resp = self.http.get(folder_url, headers=headers)
             if folder_resp.status_code != 200:
                 logging.error(
                     f"Failed to resolve folder {folder_url}: "
@@ -314,10 +590,10 @@ class Onedrive:
             folder_id = folder_resp.json()["id"]
 
             # List files in folder
-            next_link = f"{self.config['onedrive_baseurl']}/drive/items/{folder_id}/children"
+            next_link = f"{self.config['onedrive_baseurl']}/drive/items/{folder_id}/children?$select={PHOTO_LISTING_SELECT}&$top=1000"
             items: list[dict] = []
             while next_link:
-                page = requests.get(next_link, headers=headers)
+                page = self.http.get(next_link, headers=headers)
                 if page.status_code != 200:
                     logging.error(
                         f"Failed to list children for {folder_id}: "
@@ -329,7 +605,7 @@ class Onedrive:
                 items.extend(data.get("value", []))
                 next_link = data.get("@odata.nextLink")
 
-            # For each photo file: fetch description, create share link, get caption
+            # For each photo file: create share link, caption from the listed description
             for it in items:
                 name = it.get("name", "")
                 if not name.lower().endswith(PHOTO_FILE_EXTENSIONS):
@@ -337,19 +613,8 @@ class Onedrive:
 
                 item_id = it["id"]
 
-                # Get item metadata (for description; we no longer use @microsoft.graph.downloadUrl)
-                meta_url = f"{self.config['onedrive_baseurl']}/drive/items/{item_id}"
-                meta_resp = requests.get(meta_url, headers=headers)
-
-                if meta_resp.status_code != 200:
-                    logging.error(
-                        f"Failed to fetch metadata for {name}: "
-                        f"{meta_resp.status_code} {meta_resp.text}"
-                    )
-                    continue
-
-                meta_json = meta_resp.json()
-                description = meta_json.get("description") or ""
+                description = it.get("description") or ""
+                self.known_descriptions[item_id] = description
 
                 # Create (or re-use) an anonymous view sharing link
                 create_link_url = f"{self.config['onedrive_baseurl']}/drive/items/{item_id}/createLink"
@@ -357,7 +622,7 @@ class Onedrive:
                     "type": "view",
                     "scope": "anonymous",
                 }
-                link_resp = requests.post(create_link_url, headers=headers, json=link_body)
+                link_resp = self.http.post(create_link_url, headers=headers, json=link_body)
 
                 if link_resp.status_code not in (200, 201):
                     logging.error(
@@ -375,24 +640,23 @@ class Onedrive:
                 # Turn the share link into a direct-download-ish URL for <img src="">
                 public_url = self._make_public_image_url_from_share(share_url)
 
-                # Use your helper to get the caption from metadata
-                raw_caption = self.check_metadata_for_photo_caption(item_id)
-                # Normalize to None if the helper uses a sentinel string
-                if raw_caption and raw_caption != "caption key does not exist":
-                    caption = raw_caption
-                else:
-                    caption = None
-
+                metadata = parse_kv_description(description)
+                facets = photo_facets(it)
                 image_infos.append(
                     {
                         "id": item_id,
                         "filename": name,
                         "url": public_url,
                         "description": description,
-                        "caption": caption,
+                        "caption": metadata.get(PHOTO_CAPTION_METADTA_KEY) or None,
+                        **facets,
+                        "taken": metadata.get(RENDITION_TAKEN_METADATA_KEY) or facets["taken"],
                     }
                 )
 
+            # Renditions of all sources share the folder; ties (no capture time) fall back to the name.
+            image_infos.sort(key=lambda info: (info["taken"], info["filename"].lower()))
+
         except Exception as ex:
             logging.error(f"Error while getting public URLs: {ex}")
 
@@ -403,8 +667,9 @@ class Onedrive:
 
     def reset_photos_for_month(self, photos_for_month):
         for filename, photo in photos_for_month.items():
-            logging.info(f"Resetting {filename}")
-            self.set_kv_metadata_file_description(photo['id'], 'sync_status', 'unsynced')
+            logging.debug("Resetting %s", filename)
+            self.metadata_writer.set(photo['id'], 'sync_status', 'unsynced')
+        return self.metadata_writer.flush()
 
 
     def _make_public_image_url_from_share(self, share_url: str) -> str:
@@ -0,0 +1,116 @@
+# Opt-in profiling of sync pipeline stages (main.py --profile).
+# When profiling is off, stage() hands back one shared no-op context manager, and
+# cProfile / tracemalloc are never imported or started.
+import os
+import time
+import logging
+import contextlib
+
+
+_NO_PROFILING = contextlib.nullcontext()
+_active = None
+
+
+def stage(name: str):
+    """
+    Context manager wrapping one pipeline stage. Does nothing unless start() was called.
+    """
+    if _active is None:
+        return _NO_PROFILING
+    return _active.stage(name)
+
+
+def enabled() -> bool:
+    return _active is not None
+
+
+def start(out_dir: str, top_n: int = 25) -> "StageProfiler":
+    global _active
+    _active = StageProfiler(out_dir, top_n)
+    return _active
+
+
+def stop() -> str | None:
+    """
+    Stop profiling and write the report. Returns the report path, or None if profiling was off.
+    """
+    global _active
+    if _active is None:
+        return None
+    report_path = _active.write_report()
+    _active = None
+    return report_path
+
+
+class StageProfiler:
+    """
+    Runs each stage under cProfile and brackets it with tracemalloc snapshots.
+    Writes <out_dir>/<nn>-<stage>.prof (load with pstats or snakeviz) per stage, and
+    report.txt with wall time, peak traced memory, the top_n functions by cumulative
+    time and the top_n allocation sites of every stage.
+
+    cProfile only sees the thread it runs on, so the caller must keep the stage's work
+    on the calling thread (main.py runs with a single worker under --profile).
+    """
+
+    def __init__(self, out_dir: str, top_n: int = 25):
+        import tracemalloc
+
+        self.out_dir = out_dir
+        self.top_n = top_n
+        self._reports = []
+        os.makedirs(out_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        import io
+        import pstats
+        import cProfile
+        import tracemalloc
+
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+
+            safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+            prof_path = os.path.join(self.out_dir, f"{len(self._reports) + 1:02d}-{safe_name}.prof")
+            profile.dump_stats(prof_path)
+
+            hot = io.StringIO()
+            pstats.Stats(profile, stream=hot).sort_stats("cumulative").print_stats(self.top_n)
+            # Ignore tracemalloc's own bookkeeping so it doesn't crowd out the real allocation sites.
+            snapshot_filter = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            allocations = after.filter_traces(snapshot_filter).compare_to(before.filter_traces(snapshot_filter), "lineno")
+
+            lines = [
+                f"=== {name}: {wall:.2f}s wall, {peak / (1024 * 1024):.1f} MB peak traced memory ({prof_path})",
+                "",
+                f"--- top {self.top_n} functions by cumulative time",
+                hot.getvalue().strip(),
+                "",
+                f"--- top {self.top_n} allocation sites (net change during the stage)",
+                *(str(stat) for stat in allocations[:self.top_n]),
+                "",
+            ]
+            self._reports.append("\n".join(lines))
+            logging.info("Profiled stage %s: %.2fs, %.1f MB peak, %s", name, wall, peak / (1024 * 1024), prof_path)
+
+    def write_report(self) -> str:
+        import tracemalloc
+
+        report_path = os.path.join(self.out_dir, "report.txt")
+        with open(report_path, "w") as f:
+            f.write("\n\n".join(self._reports))
+        tracemalloc.stop()
+        return report_path
@@ -1,42 +1,196 @@
 
 import os
+import json
+import time
+import atexit
 import logging
 import datetime
-from dotenv import load_dotenv
-from logging.handlers import RotatingFileHandler
+import threading
 
-def init_settings():
+
+# Standard LogRecord attributes; anything else on a record came in through extra= and is logged as a field.
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_log_listener = None
+
+
+class JsonFormatter(logging.Formatter):
     """
-    Initialize settings
+    One JSON object per line: time, level, message, call site, thread, plus any extra= fields.
     """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+            "where": f"{record.module}:{record.lineno}",
+            "thread": record.threadName,
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _LOG_RECORD_ATTRS})
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (file + line) for records below WARNING: a burst of `burst`
+    records, then `per_second`. Dropped records are counted and reported as `suppressed`
+    on the next record from the same call site. Warnings and errors always pass.
+    """
+
+    def __init__(self, per_second: float = 5, burst: int = 50):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self._buckets = {}  # (pathname, lineno) -> [tokens, last refill, suppressed count]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [self.burst, now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+def init_logging(log_path: str = 'ghost-onedrive-sync.log') -> None:
+    """
+    Log through a queue: callers only filter and enqueue, a background thread formats
+    records as JSON and writes them to the rotating log file.
+    """
+    global _log_listener
+    import queue
+    from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        atexit.unregister(_log_listener.stop)
+
     # Sets a rotating file handler for logging, up to 100 MB in 3 files
+    file_handler = RotatingFileHandler(log_path, maxBytes=100000000, backupCount=3)
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))  # the JSON formatting happens in the listener
+    queue_handler.addFilter(RateLimitFilter(
+        per_second=float(os.getenv('LOG_RATE_PER_SECOND', '5')),
+        burst=int(os.getenv('LOG_RATE_BURST', '50')),
+    ))
+
     logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s %(levelname)s %(message)s',
-        handlers=[
-            RotatingFileHandler('ghost-onedrive-sync.log', maxBytes=100000000, backupCount=3)
-        ],
+        level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+        handlers=[queue_handler],
         force=True
     )
 
+    _log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _log_listener.start()
+    # Drain the queue on exit so the last records (errors, the run summary) reach the file.
+    atexit.register(_log_listener.stop)
+
+
+def init_settings(log_to_file: bool = True):
+    """
+    Initialize settings
+    log_to_file=False skips the log file setup, for read-only commands that should start fast.
+    """
+    # Imported here rather than at module level to keep CLI startup cheap.
+    from dotenv import load_dotenv
+
     load_dotenv()
+    if log_to_file:
+        init_logging()
+
     onedrive_baseurl = 'https://graph.microsoft.com/v1.0/me'
     onedrive_base_path = 'drive/root:'
     onedrive_camera_path = f"Pictures/Samsung Gallery/DCIM/Camera"
     onedrive_web_path = f"Pictures/Web Optimized"
-    this_month_folder_name: str = datetime.datetime.now().strftime("%Y/%m")
     config = {}
     config["client_id"]	= os.getenv('CLIENT_ID')
     config["authority"]	= 'https://login.microsoftonline.com/consumers'
     config["token_cache_path"] = 'token_cache.json'
     config["scopes"] = ["Files.ReadWrite.All"]
     config["onedrive_camera_endpoint"] = f"{onedrive_baseurl}/{onedrive_base_path}/{onedrive_camera_path}:/children"
-    config["onedrive_web_endpoint"] = f"{onedrive_baseurl}/{onedrive_base_path}/{onedrive_web_path}/{this_month_folder_name}:/children"
-    config["onedrive_upload_endpoint"] = f"{onedrive_baseurl}/{onedrive_base_path}/{onedrive_web_path}/{this_month_folder_name}"  # /"{{filename}}:/content"  <- MUST APPEND WHEN WE GET FILENAME
     config["onedrive_baseurl"] = onedrive_baseurl
+    config["onedrive_base_path"] = onedrive_base_path
     config["onedrive_camera_path"] = onedrive_camera_path
     config["onedrive_web_path"] = onedrive_web_path
     config["download_dir"] = 'downloads'
     config["output_dir"] = os.getenv('OUTPUT_DIR', 'optimized')
+    config["encode_cache_dir"] = os.getenv('ENCODE_CACHE_DIR', 'encode_cache')
+    config["encode_cache_max_mb"] = int(os.getenv('ENCODE_CACHE_MAX_MB', '512'))
+    config["min_ssim"] = float(os.getenv('MIN_SSIM', '0.985')) or None  # perceptual rate control, 0 = byte budget only
+    config["download_max_kbps"] = int(os.getenv('DOWNLOAD_MAX_KBPS', '0'))  # 0 = unlimited, shared by all parallel downloads of all sources
+    config["backfill_workers"] = int(os.getenv('BACKFILL_WORKERS', '4'))
+    config["run_deadline_minutes"] = float(os.getenv('RUN_DEADLINE_MINUTES', '0'))  # 0 = no time limit
+    config["graph_requests_per_second"] = float(os.getenv('GRAPH_REQUESTS_PER_SECOND', '0'))  # per account, 0 = unlimited
+    config["sources_file"] = os.getenv('SOURCES_FILE', 'sources.json')
+
+    return month_settings(config, datetime.datetime.now().strftime("%Y%m"))
+
+
+def month_settings(config: dict, month: str) -> dict:
+    """
+    Returns a copy of config pointing at the web optimized folder of one month.
+    month is 'YYYYMM', the same prefix the camera uses in photo file names.
+    """
+    month_folder_name: str = f"{month[:4]}/{month[4:]}"
+    web_folder = f"{config['onedrive_baseurl']}/{config['onedrive_base_path']}/{config['onedrive_web_path']}/{month_folder_name}"
+
+    month_config = dict(config)
+    month_config["month"] = month
+    month_config["onedrive_web_endpoint"] = f"{web_folder}:/children"
+    month_config["onedrive_upload_endpoint"] = web_folder  # /"{{filename}}:/content"  <- MUST APPEND WHEN WE GET FILENAME
+    return month_config
+
+
+def load_sources(config: dict) -> list[dict]:
+    """
+    Returns one config per photo source: a camera folder on one OneDrive account.
+    Sources are listed in config["sources_file"], a JSON list of objects like
+      {"name": "alex", "camera_path": "Pictures/Camera Roll", "token_cache_path": "token_cache-alex.json",
+       "workers": 2, "requests_per_second": 4, "download_max_kbps": 2048}
+    where everything but "name" is optional. A source's download_max_kbps caps that source on
+    top of DOWNLOAD_MAX_KBPS, which all sources share. The first source's account owns the web folder
+    the renditions are published to. Without the file, the single source is the camera
+    folder and token cache from config.
+    """
+    if not os.path.exists(config["sources_file"]):
+        return [source_settings(config, {"name": ""})]
+
+    with open(config["sources_file"]) as f:
+        sources = json.load(f)
+    if not sources:
+        raise Exception(f"{config['sources_file']} lists no sources")
+    names = [source.get("name") for source in sources]
+    if not all(names) or len(set(names)) != len(names):
+        raise Exception(f"Every source in {config['sources_file']} needs a unique name")
+    return [source_settings(config, source) for source in sources]
+
+
+def source_settings(config: dict, source: dict) -> dict:
+    """
+    Returns a copy of config reading from one source (an entry of the sources file, see load_sources).
+    """
+    camera_path = source.get("camera_path", config["onedrive_camera_path"])
 
-    return config
\ No newline at end of file
+    source_config = dict(config)
+    source_config["source_name"] = source["name"]
+    source_config["onedrive_camera_path"] = camera_path
+    source_config["onedrive_camera_endpoint"] = f"{config['onedrive_baseurl']}/{config['onedrive_base_path']}/{camera_path}:/children"
+    source_config["token_cache_path"] = source.get("token_cache_path", config["token_cache_path"])
+    source_config["source_workers"] = int(source.get("workers", 0))  # 0 = an even share of the run's workers
+    source_config["graph_requests_per_second"] = float(source.get("requests_per_second", config["graph_requests_per_second"]))
+    source_config["source_download_max_kbps"] = int(source.get("download_max_kbps", 0))  # 0 = only the shared cap
+    return source_config
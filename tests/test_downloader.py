@@ -0,0 +1,68 @@
+import base64
+import random
+
+from downloader import QuickXorHash
+
+
+def reference_quick_xor_hash(data: bytes) -> str:
+    """
+    Line by line port of Microsoft's reference QuickXorHash (C#), fed the data in one block.
+    """
+    width_in_bits, shift = 160, 11
+    bits_in_last_cell = 32
+    cells = [0] * ((width_in_bits - 1) // 64 + 1)
+    mask64 = (1 << 64) - 1
+
+    vector_array_index = 0
+    vector_offset = 0
+    for i in range(min(len(data), width_in_bits)):
+        is_last_cell = vector_array_index == len(cells) - 1
+        bits_in_vector_cell = bits_in_last_cell if is_last_cell else 64
+        if vector_offset <= bits_in_vector_cell - 8:
+            for j in range(i, len(data), width_in_bits):
+                cells[vector_array_index] ^= (data[j] << vector_offset) & mask64
+        else:
+            index2 = 0 if is_last_cell else vector_array_index + 1
+            low = bits_in_vector_cell - vector_offset
+            xored_byte = 0
+            for j in range(i, len(data), width_in_bits):
+                xored_byte ^= data[j]
+            cells[vector_array_index] ^= (xored_byte << vector_offset) & mask64
+            cells[index2] ^= xored_byte >> low
+        vector_offset += shift
+        while vector_offset >= bits_in_vector_cell:
+            vector_array_index = 0 if is_last_cell else vector_array_index + 1
+            vector_offset -= bits_in_vector_cell
+
+    result = bytearray()
+    for cell in cells[:-1]:
+        result += cell.to_bytes(8, "little")
+    result += (cells[-1] & ((1 << bits_in_last_cell) - 1)).to_bytes(bits_in_last_cell // 8, "little")
+    for i, length_byte in enumerate(len(data).to_bytes(8, "little")):
+        result[width_in_bits // 8 - 8 + i] ^= length_byte
+    return base64.b64encode(bytes(result)).decode("ascii")
+
+
+def hash_in_chunks(data: bytes, chunk_sizes) -> str:
+    hasher = QuickXorHash()
+    position = 0
+    while position < len(data):
+        size = next(chunk_sizes)
+        hasher.update(data[position:position + size])
+        position += size
+    return hasher.b64digest()
+
+
+def test_empty_input():
+    assert QuickXorHash().b64digest() == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+    assert reference_quick_xor_hash(b"") == "AAAAAAAAAAAAAAAAAAAAAAAAAAA="
+
+
+def test_matches_reference_with_random_chunk_sizes():
+    rng = random.Random(1234)
+    for length in [1, 7, 159, 160, 161, 319, 320, 1000, 4096, 70000]:
+        data = rng.randbytes(length)
+        expected = reference_quick_xor_hash(data)
+        for _ in range(5):
+            chunk_sizes = iter(lambda: rng.choice([1, 3, 20, 159, 160, 161, 500, 8192]), None)
+            assert hash_in_chunks(data, chunk_sizes) == expected, length
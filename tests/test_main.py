@@ -0,0 +1,38 @@
+import threading
+
+from main import NewestFirstPool
+
+
+def test_newest_first_pool_runs_plan_jobs_then_newest_photos():
+    pool = NewestFirstPool(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    # Occupy the only worker so everything below queues up before anything else runs.
+    first = pool.submit(blocker)
+    assert started.wait(5)
+
+    futures = [
+        pool.submit(order.append, "photo 2024-01", capture_key=("2024-01-01T00:00:00Z", "a.jpg")),
+        pool.submit(order.append, "photo 2024-03", capture_key=("2024-03-01T00:00:00Z", "b.jpg")),
+        pool.submit(order.append, "plan 1"),
+        pool.submit(order.append, "photo 2024-02", capture_key=("2024-02-01T00:00:00Z", "c.jpg")),
+        pool.submit(order.append, "plan 2"),
+    ]
+    release.set()
+    for future in [first, *futures]:
+        future.result(5)
+    pool.shutdown()
+
+    assert order == ["plan 1", "plan 2", "photo 2024-03", "photo 2024-02", "photo 2024-01"]
+
+
+def test_newest_first_pool_reports_job_errors():
+    pool = NewestFirstPool(max_workers=2)
+    future = pool.submit(int, "not a number", capture_key=("", "x.jpg"))
+    pool.shutdown()
+    assert isinstance(future.exception(), ValueError)
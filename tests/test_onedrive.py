@@ -0,0 +1,91 @@
+import json
+
+from onedrive import MetadataWriter, Onedrive, parse_kv_description, retry_after_seconds
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeHttp:
+    """Answers every $batch request with 200 and records what was sent."""
+
+    def __init__(self):
+        self.batches = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.batches.append(json["requests"])
+        return FakeResponse({"responses": [{"id": request["id"], "status": 200, "body": {}} for request in json["requests"]]})
+
+
+class FakeOnedrive:
+    access_token = "token"
+    graph_batch_url = "https://graph.example/$batch"
+
+    def __init__(self, known_descriptions):
+        self.known_descriptions = dict(known_descriptions)
+        self.http = FakeHttp()
+
+    def graph_item_path(self, file_id):
+        return f"/me/drive/items/{file_id}"
+
+
+def test_plain_text_caption_survives_sync_status_merge():
+    onedrive = FakeOnedrive({"photo-1": "Sunset at the lake"})
+    writer = MetadataWriter(onedrive)
+
+    writer.set("photo-1", "sync_status", "synced")
+    assert writer.flush() == []
+
+    [batch] = onedrive.http.batches
+    [request] = batch
+    assert request["method"] == "PATCH"
+    assert json.loads(request["body"]["description"]) == {"caption": "Sunset at the lake", "sync_status": "synced"}
+    assert parse_kv_description(onedrive.known_descriptions["photo-1"])["caption"] == "Sunset at the lake"
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds("7", 2) == 7
+    assert retry_after_seconds("Wed, 21 Oct 2026 07:28:00 GMT", 2) == 2
+    assert retry_after_seconds(None, 4) == 4
+
+
+class FakeFolderHttp:
+    """A web folder holding the given items, every one of which can be shared."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def get(self, url, headers=None):
+        if "/children" in url:
+            return FakeResponse({"value": self.items})
+        return FakeResponse({"id": "folder"})
+
+    def post(self, url, headers=None, json=None):
+        item_id = url.split("/items/")[1].split("/")[0]
+        return FakeResponse({"link": {"webUrl": f"https://1drv.ms/i/s!{item_id}"}})
+
+
+def test_gallery_is_ordered_by_the_capture_time_stored_on_the_renditions():
+    class FolderOnedrive(Onedrive):
+        access_token = "token"
+
+    onedrive = FolderOnedrive.__new__(FolderOnedrive)
+    onedrive.config = {"onedrive_baseurl": "https://graph.example/me"}
+    onedrive.known_descriptions = {}
+    onedrive.http = FakeFolderHttp([
+        {"id": "1", "name": "holiday.webp", "description": json.dumps({"taken": "2025-01-03T09:00:00Z"})},
+        {"id": "2", "name": "20250101_120000.webp", "description": ""},
+        {"id": "3", "name": "beach.webp", "description": json.dumps({"taken": "2025-01-02T09:00:00Z", "caption": "Beach"})},
+    ])
+
+    gallery = onedrive.get_public_urls_and_captions_for_photos_in_folder("https://graph.example/me/drive/root:/Web/2025/01")
+
+    assert [info["filename"] for info in gallery] == ["20250101_120000.webp", "beach.webp", "holiday.webp"]
+    assert [info["caption"] for info in gallery] == [None, "Beach", None]